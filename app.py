@@ -8,30 +8,90 @@
 
 # Import Basic Library requirements.
 from flask import Flask, render_template, request, \
-    jsonify, make_response, Response
+    make_response, Response, g
 from config import get_rest_information, get_redis_config, \
-    get_postgresql_config, get_amqp_config
-from handle_redis import RedisHandler
+    get_redis_pool_config, \
+    get_postgresql_config, get_postgresql_pool_config, get_amqp_config, \
+    get_write_behind_config, get_rpc_pool_config, get_authentication_config, \
+    get_counter_config, get_query_cache_config, get_health_config, \
+    get_config_reload_config, enable_hot_reload, add_reload_listener, \
+    get_page_cache_config, get_compression_config, get_task_wait_config, \
+    get_result_output_config
+from handle_redis import RedisHandler, RedisCounter
 from handle_postgres import PostgreSQL
+from handle_write_behind import WriteBehind, COMMITTED, FAILED
+from handle_rpc import RpcProxyPool
+from handle_auth import CredentialVerifier
+from handle_cache import QueryCache
+from handle_metrics import REGISTRY
+from handle_page_cache import PageCache, StaticFingerprints
+from handle_encoding import Compressor, dumps, text_type
+from handle_results import PENDING, MISSING, EXPIRED, \
+    FAILED as TASK_FAILED
+from handle_digits import iter_chunks, DECIMAL, DIGITS, HEAD, TAIL, HEX
+from handle_health import HealthMonitor, redis_probe, postgres_probe, \
+    amqp_probe
 from flask.ext.httpauth import HTTPBasicAuth
-import md5
+import threading
 from functools import wraps
-from nameko.standalone.rpc import ServiceRpcProxy
+from timeit import default_timer
+import binascii
 
 # Some Global Variable to handle REDIS, POSTGRES and RABBITMQ.
 REDIS = None
 POSTGRES = None
-COUNTER = 1
-AUTHENTICATION = {
-    "username": "5cc0ad025dd42c5b70e193e77fcc5e96",
-    "password": "5f4dcc3b5aa765d61d8327deb882cf99"
-}
+WRITER = None
+CACHE = None
+RPC_POOL = None
+RPC_POOL_LOCK = threading.Lock()
+RPC_WAIT_POOL = None
+RPC_WAIT_POOL_LOCK = threading.Lock()
+WAIT_CLIENTS = 0
+WAIT_CLIENTS_LOCK = threading.Lock()
+VERIFIER = None
+VERIFIER_LOCK = threading.Lock()
+COUNTER = None
+HEALTH = None
+INSERT_QUERY = "INSERT INTO DEMO (USERNAME, EMAIL) VALUES(%s, %s)"
+BULK_INSERT_QUERY = "INSERT INTO DEMO (USERNAME, EMAIL) VALUES %s"
+REDIS_PAGE_SIZE = 500
+REDIS_MAX_PAGE_SIZE = 5000
+POSTGRES_PAGE_SIZE = 100
+POSTGRES_MAX_PAGE_SIZE = 1000
+POSTGRES_STREAM_CHUNK = 1000
+BULK_MAX_PAYLOADS = 10000
+RESULT_MODES = (DECIMAL, DIGITS, HEAD, TAIL, HEX)
+RESULT_STATUS_CODES = {PENDING: 202, MISSING: 404, EXPIRED: 410,
+                       TASK_FAILED: 500}
 
 # This line initializes a Flask Application for the Current __name__.
 app = Flask(__name__)
 app.config['SECRET_KEY'] = "Luke I am Your Father !"
 auth = HTTPBasicAuth()
 
+REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_seconds", "Time taken to handle the requests.",
+    ("endpoint", "method"))
+RESPONSES = REGISTRY.counter(
+    "http_responses_total", "Responses sent by status code.",
+    ("endpoint", "status"))
+
+# The pages that only render a template are cached once rendered and the
+# static files are linked with a fingerprint of their content.
+(PAGE_CACHE_ENABLED, PAGE_MAX_AGE, PAGE_CACHE_ENTRIES,
+ STATIC_MAX_AGE) = get_page_cache_config()
+PAGE_CACHE = PageCache(enabled=PAGE_CACHE_ENABLED,
+                       max_entries=PAGE_CACHE_ENTRIES,
+                       max_age=PAGE_MAX_AGE)
+STATIC_FINGERPRINTS = StaticFingerprints(app.static_folder)
+
+(COMPRESSION_ENABLED, COMPRESSION_MIN_SIZE, COMPRESSION_LEVEL,
+ COMPRESSION_FLUSH_SIZE) = get_compression_config()
+COMPRESSOR = Compressor(enabled=COMPRESSION_ENABLED,
+                        min_size=COMPRESSION_MIN_SIZE,
+                        level=COMPRESSION_LEVEL,
+                        flush_size=COMPRESSION_FLUSH_SIZE)
+
 
 """
     The Routing Functions are listed in the Below Code Section. Please be
@@ -40,11 +100,72 @@ auth = HTTPBasicAuth()
 """
 
 
+# Start the clock for the request timings exported on /metrics.
+@app.before_request
+def start_timer():
+    g.started = default_timer()
+
+
+# Record the time taken by the request against its route. Requests that
+# don't match any route are all recorded as unmatched to keep the number of
+# series bounded.
+@app.after_request
+def record_timing(response):
+    started = getattr(g, "started", None)
+    if started is not None:
+        endpoint = request.endpoint or "unmatched"
+        REQUEST_SECONDS.observe(default_timer() - started,
+                                (endpoint, request.method))
+        RESPONSES.inc((endpoint, str(response.status_code)))
+    return response
+
+
+# Add the fingerprint of the file to every URL built for a static file. Ex:
+# /static/style.css?v=1a2b3c4d5e6f
+@app.url_defaults
+def static_fingerprint(endpoint, values):
+    if endpoint == "static" and "filename" in values:
+        fingerprint = STATIC_FINGERPRINTS.get(values["filename"])
+        if fingerprint is not None:
+            values["v"] = fingerprint
+
+
+# Static files requested with their current fingerprint never change, so
+# the browsers may keep them for a long time.
+@app.after_request
+def cache_static(response):
+    if request.endpoint == "static" and response.status_code == 200 and \
+            request.args.get("v") is not None and \
+            request.args.get("v") == STATIC_FINGERPRINTS.get(
+                request.view_args.get("filename")):
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+    return response
+
+
+# Compress the responses for the clients that accept gzip or deflate.
+@app.after_request
+def compress_response(response):
+    return COMPRESSOR.compress(response,
+                               request.headers.get("Accept-Encoding"))
+
+
+# Send a value as JSON. The output is compact unless the request asks for a
+# readable one with ?pretty.
+def json_response(value):
+    return Response(dumps(value, pretty=wants_pretty()),
+                    mimetype="application/json")
+
+
+def wants_pretty():
+    return "pretty" in request.args
+
+
 # Basic Error Handler Mode. This will come in handly in case your application
 # runs into an error. This can return a JSON response string.
 @app.errorhandler(404)
 def not_found(error):
-    return make_response(jsonify({'error': 'Not found'}), 404)
+    return make_response(json_response({'error': 'Not found'}), 404)
 
 
 # Write a Custom authentication mode function that gets invoked each time you
@@ -75,6 +196,7 @@ def authenticate(f):
 # This is the base URL Routing Function. Let's put a Sample Demo HTML page in
 # here.
 @app.route('/')
+@PAGE_CACHE.cached
 def home():
     """
         This Page Renders a basic HTML page with a Message displayed in h3.
@@ -84,6 +206,7 @@ def home():
 
 # A Sample Routing path to show how the Routing for Different URL works.
 @app.route("/sample/")
+@PAGE_CACHE.cached
 def sample():
     """
         This Page Renders the Same Message as Basic HTML Home page. Along with
@@ -95,6 +218,7 @@ def sample():
 # Following Section Shows an HTML form for the User and Prompts him to enter
 # an input message which gets pushed to a Secondary Page for Rendering.
 @app.route("/signup/")
+@PAGE_CACHE.cached
 def signup():
     """
         This Page Prompts the User with an HTML page that expects him to enter
@@ -123,6 +247,7 @@ def submit():
 # Rest Mode. This show the usage of Redis as an in-memory cache before
 # it can be persisted onto any of the Databases.
 @app.route("/redis-signup/")
+@PAGE_CACHE.cached
 def redis_signup():
     return render_template("signup.html", redis=1)
 
@@ -146,7 +271,6 @@ def create_redis_item():
     """
     global REDIS
     global POSTGRES
-    global COUNTER
     has_redis = False
     persist = False
     message = dict()
@@ -156,23 +280,7 @@ def create_redis_item():
             "state": "failure",
             "error": "payload key not found. Invalid Payload Data"
         }
-        return jsonify({'message': message}), 400
-
-    if 'username' not in request.json.get('payload') or \
-            'email' not in request.json.get('payload'):
-        message = {
-            "state": "failure",
-            "error": "username & email are mandatory. Invalid Payload Data."
-        }
-        return jsonify({'message': message}), 400
-    payload = request.json.get('payload')
-
-    if payload.get('username') is None or payload.get('email') is None:
-        message = {
-            "state": "failure",
-            "error": "Username & email can't be empty. Invalid payload data."
-        }
-        return jsonify({'message': message}), 400
+        return json_response({'message': message}), 400
 
     if 'redis' in request.json:
         if request.json.get('redis'):
@@ -182,6 +290,18 @@ def create_redis_item():
         if request.json.get('persist'):
             persist = True
 
+    payload = request.json.get('payload')
+    if isinstance(payload, list):
+        return create_redis_items(payload, has_redis, persist)
+
+    error = validate_payload(payload)
+    if error is not None:
+        message = {
+            "state": "failure",
+            "error": error
+        }
+        return json_response({'message': message}), 400
+
     message = {
         "state": "successful",
         "info": "Hello, young padawan " + payload.get("username") + "," +
@@ -193,27 +313,105 @@ def create_redis_item():
     if has_redis:
         message['info'] = ""
         REDIS.add_to_redis(payload.get("username"), payload.get("email"))
-        REDIS.add_to_redis("inserts", COUNTER)
-        COUNTER += 1
+        redis_status = "failed" if REDIS.check_error() else "stored"
+        COUNTER.add()
         message['info'] = "Hello, master " + payload.get("username") + \
             ", the ONE RING has been waiting for you all this time. \n" + \
             "Looks like we finally found each other. " + \
             "To claim the ONE RING, please check your email " + \
             payload.get("email")
-        message['redis_status'] = "stored"
+        message['redis_status'] = redis_status
 
     if persist:
-        query = "INSERT INTO DEMO (USERNAME, EMAIL) VALUES(%s, %s)"
-        POSTGRES.run_query_store(
-            query_string=query,
-            binding=(
-                payload.get("username"),
-                payload.get("email")
-            )
-        )
-        message['persist'] = "successful"
+        message['persist_status'] = persist_signup(
+            payload.get("username"),
+            payload.get("email"))
+        message['persist'] = persist_state(message['persist_status'])
+
+    return json_response({'message': message}), 200
+
+
+# Bulk variant of the /redis-rest-submit route. This gets invoked when the
+# payload key holds a list of payloads instead of a single one. All of them
+# are validated upfront and the valid ones get written using a single Redis
+# round-trip and a single multi-row INSERT.
+def create_redis_items(payloads, has_redis, persist):
+    """
+        This function processes a list of payloads from a RESTful POST
+        request and reports the status of each one of them.
 
-    return jsonify({'message': message}), 200
+        @:parameter
+            payloads    -   List of payloads with a username and email.
+            has_redis   -   Store the valid payloads into Redis.
+            persist     -   Persist the valid payloads into PostgreSQL.
+    """
+    global REDIS
+
+    if len(payloads) > BULK_MAX_PAYLOADS:
+        message = {
+            "state": "failure",
+            "error": "Too many payloads. A request can carry at most " +
+            str(BULK_MAX_PAYLOADS) + " of them."
+        }
+        return json_response({'message': message}), 413
+
+    results = list()
+    signups = list()
+    for index, payload in enumerate(payloads):
+        error = validate_payload(payload)
+        if error is not None:
+            results.append({"index": index, "state": "failure",
+                            "error": error})
+        else:
+            results.append({"index": index, "state": "successful"})
+            signups.append((payload.get("username"), payload.get("email")))
+
+    message = {
+        "state": "successful",
+        "accepted": len(signups),
+        "rejected": len(payloads) - len(signups),
+        "results": results
+    }
+    if len(signups) == 0:
+        message['state'] = "failure"
+        return json_response({'message': message}), 400
+
+    valid = [result for result in results if result['state'] == "successful"]
+    if has_redis:
+        REDIS.add_many_to_redis(dict(signups))
+        redis_status = "failed" if REDIS.check_error() else "stored"
+        COUNTER.add(len(signups))
+        for result in valid:
+            result['redis_status'] = redis_status
+
+    if persist:
+        statuses = persist_signups(signups)
+        for result, status in zip(valid, statuses):
+            result['persist_status'] = status
+            result['persist'] = persist_state(status)
+
+    return json_response({'message': message}), 200
+
+
+def validate_payload(payload):
+    """
+        Validates a single signup payload.
+
+        @:return
+            error   -   Reason the payload is invalid. None if it is valid.
+    """
+    if not isinstance(payload, dict) or 'username' not in payload or \
+            'email' not in payload:
+        return "username & email are mandatory. Invalid Payload Data."
+    for key in ('username', 'email'):
+        value = payload.get(key)
+        if value is None:
+            return "Username & email can't be empty. Invalid payload data."
+        if not isinstance(value, (str, text_type)):
+            return key + " must be a string. Invalid payload data."
+        if len(value.strip()) == 0:
+            return "Username & email can't be empty. Invalid payload data."
+    return None
 
 
 # The Following Section of the Code acts as a Post Submit Action Handler that
@@ -228,7 +426,6 @@ def redis_submit():
         This behavior can be reproduced on any rest services.
     """
     global REDIS
-    global COUNTER
     global POSTGRES
     username = request.form['username']
     email = request.form['useremail']
@@ -238,9 +435,9 @@ def redis_submit():
     else:
         persist = 0
 
-    if REDIS is None or REDIS.check_error():
+    if REDIS is None or not REDIS.is_available():
         if REDIS is not None:
-            message = REDIS.check_error()
+            message = "REDIS is unavailable. Please try again shortly."
         else:
             message = "No REDIS Object Handler Found."
         return render_template(
@@ -248,21 +445,19 @@ def redis_submit():
             name=username,
             email=email,
             message=message)
-    REDIS.reset_error()
     REDIS.add_to_redis(username, email)
-    REDIS.add_to_redis("inserts", COUNTER)
-    COUNTER += 1
+    error = REDIS.check_error()
+    COUNTER.add()
 
     if persist:
-        query = "INSERT INTO DEMO (USERNAME, EMAIL) VALUES(%s, %s)"
-        POSTGRES.run_query_store(query_string=query, binding=(username, email))
+        persist_signup(username, email)
 
-    if REDIS.check_error():
+    if error:
         return render_template(
             "error.html",
             name=username,
             email=email,
-            message=REDIS.check_error())
+            message=error)
     else:
         return render_template(
             "submit.html",
@@ -272,15 +467,57 @@ def redis_submit():
 
 
 # The following Code is for Displaying the Entities in the Redis Cache.
+# The key space is paged through using SCAN. Pass the cursor returned with a
+# page back in to obtain the next one.
 @app.route("/get-redis")
 def get_redis():
     """
         This Function obtains the data in Redis KEY Value pair and returns them
         in an array so that it can be rendered into a neat table in the HTML.
+
+        @:parameter
+            cursor  -   SCAN cursor to continue from. Defaults to 0.
+            limit   -   Minimum number of items to show on a page.
+            match   -   Optional glob pattern to filter the keys.
     """
     global REDIS
-    redis_data = REDIS.get_all_keys()
-    return render_template("redis.html", redis_data=redis_data)
+    cursor = request.args.get("cursor", 0, type=int)
+    limit = request.args.get("limit", REDIS_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, REDIS_MAX_PAGE_SIZE))
+    match = request.args.get("match")
+    redis_data = list()
+    while True:
+        cursor, items = REDIS.scan_page(cursor, match=match, count=limit)
+        error = REDIS.check_error()
+        if error:
+            return render_template(
+                "error.html",
+                name="",
+                email="",
+                message=error), 503
+        redis_data.extend(items)
+        if cursor == 0 or len(redis_data) >= limit:
+            break
+    return render_template("redis.html",
+                           redis_data=redis_data,
+                           next_cursor=cursor,
+                           limit=limit,
+                           match=match)
+
+
+# The following route returns the number of inserts counted in REDIS across
+# all the instances of this application.
+@app.route("/redis-inserts")
+def redis_inserts():
+    global COUNTER
+    inserts = COUNTER.get()
+    if inserts is None:
+        message = {
+            "state": "failure",
+            "error": "Failed to Read the Insert Counter from REDIS."
+        }
+        return json_response({'message': message}), 503
+    return json_response({'inserts': inserts}), 200
 
 
 # This route is provided for you to check if the REDIS connection is setup
@@ -290,7 +527,7 @@ def redis_status():
     global REDIS
     return render_template(
         "redis_status.html",
-        json_data=REDIS.get_redis_info())
+        json_data=REDIS.get_redis_info(pretty=wants_pretty()))
 
 
 # This Route acts as a way to check the Status for PostgreSQL.
@@ -310,21 +547,290 @@ def postgres_status():
         message=message)
 
 
+# Liveness check. This answers as long as the process serves requests and
+# reports the cached dependency checks for information only. A dependency
+# that is down must not get the process restarted, /readyz covers that.
+@app.route("/healthz")
+def healthz():
+    response = {"status": "ok"}
+    if HEALTH is not None:
+        (_, checks) = HEALTH.get_health()
+        response["uptime"] = HEALTH.get_uptime()
+        response["checks"] = checks
+    return json_response(response)
+
+
+# Readiness check. This fails with a 503 while REDIS, PostgreSQL or the AMQP
+# broker is down, as seen by the last background probe. It never contacts
+# the dependencies itself.
+@app.route("/readyz")
+def readyz():
+    if HEALTH is None:
+        return make_response(json_response({"status": "not ready"}), 503)
+    (ready, checks) = HEALTH.get_health()
+    response = json_response({
+        "status": "ready" if ready else "not ready",
+        "checks": checks
+    })
+    if not ready:
+        return make_response(response, 503)
+    return response
+
+
+# This route exports the request, REDIS, PostgreSQL and RPC timings along
+# with the pool utilization in the Prometheus text format.
+@app.route("/metrics")
+def metrics():
+    return Response(REGISTRY.render(),
+                    mimetype="text/plain; version=0.0.4")
+
+
+# These functions read the pool and queue figures of the handlers when the
+# metrics are scraped.
+def postgres_pool_metrics():
+    if POSTGRES is None:
+        return None
+    stats = POSTGRES.get_pool_stats()
+    if stats is None:
+        return None
+    return dict(((state,), stats[state]) for state in ("size", "in_use"))
+
+
+def rpc_pool_metrics():
+    metrics = dict()
+    for (name, pool) in (("default", RPC_POOL), ("wait", RPC_WAIT_POOL)):
+        if pool is None:
+            continue
+        stats = pool.get_stats()
+        for state in ("size", "in_use", "idle"):
+            metrics[(name, state)] = stats[state]
+    return metrics or None
+
+
+def write_behind_metrics():
+    if WRITER is None:
+        return None
+    return {(): WRITER.pending}
+
+
+def redis_circuit_metrics():
+    if REDIS is None:
+        return None
+    stats = REDIS.breaker.get_stats()
+    return dict(((state,), int(stats["state"] == state))
+                for state in ("closed", "open", "half-open"))
+
+
+def page_cache_metrics():
+    stats = PAGE_CACHE.get_stats()
+    return {("hit",): stats["hits"], ("miss",): stats["misses"]}
+
+
+def query_cache_metrics():
+    if CACHE is None:
+        return None
+    stats = CACHE.get_stats()
+    return {("hit",): stats["hits"], ("miss",): stats["misses"]}
+
+
+REGISTRY.callback("postgres_pool_connections",
+                  "PostgreSQL pool size and connections checked out.",
+                  postgres_pool_metrics, ("state",))
+REGISTRY.callback("rpc_pool_proxies",
+                  "RPC proxy pools size, proxies in use and idle.",
+                  rpc_pool_metrics, ("pool", "state"))
+REGISTRY.callback("write_behind_pending",
+                  "Records queued for the next write-behind flush.",
+                  write_behind_metrics)
+REGISTRY.callback("redis_circuit_state",
+                  "State of the REDIS circuit breaker, 1 for the current.",
+                  redis_circuit_metrics, ("state",))
+REGISTRY.callback("page_cache_lookups_total",
+                  "Rendered page cache lookups by result.",
+                  page_cache_metrics, ("result",), kind="counter")
+REGISTRY.callback("query_cache_lookups_total",
+                  "PostgreSQL query cache lookups by result.",
+                  query_cache_metrics, ("result",), kind="counter")
+
+
+# Persist a Signup into the DEMO table. When the write-behind mode is enabled
+# the record is only queued here and gets committed in bulk later on.
+def persist_signup(username, email):
+    """
+        Stores the user information into PostgreSQL either directly or
+        through the write-behind queue.
+
+        @:return
+            status  -   queued, committed or failed.
+    """
+    global POSTGRES
+    global WRITER
+    if WRITER is not None:
+        return WRITER.submit((username, email))
+    error = POSTGRES.run_query_store(
+        query_string=INSERT_QUERY,
+        binding=(username, email))
+    if error is None or len(error) > 0:
+        return FAILED
+    invalidate_postgres_cache()
+    return COMMITTED
+
+
+# Queued records count as successful since the write-behind queue owns them
+# from then on.
+def persist_state(status):
+    return "failed" if status == FAILED else "successful"
+
+
+# Persist a batch of Signups into the DEMO table using a single multi-row
+# INSERT, or through the write-behind queue when it is enabled.
+def persist_signups(signups):
+    """
+        Stores a list of (username, email) pairs into PostgreSQL.
+
+        @:return
+            statuses    -   queued, committed or failed for each pair.
+    """
+    global POSTGRES
+    global WRITER
+    if WRITER is not None:
+        return WRITER.submit_many(signups)
+    error = POSTGRES.run_query_store_many(BULK_INSERT_QUERY, signups)
+    if error is None or len(error) > 0:
+        return [FAILED] * len(signups)
+    invalidate_postgres_cache()
+    return [COMMITTED] * len(signups)
+
+
+# Drop the cached DEMO query results after a write. Readers in the other
+# processes notice the change within the version_ttl of the cache.
+def invalidate_postgres_cache(*args):
+    global CACHE
+    if CACHE is not None:
+        CACHE.invalidate()
+
+
 # This function Routes the request made by the End user into a function that
 # handles the process of getting the data from PostgreSQL machine and
 # displaying it to the end user in HTML table format.
+# The table is paged using the ID column. Pass the last ID of a page as the
+# after argument to obtain the next one.
 @app.route("/get-postgres")
 def get_postgres():
+    (after, limit) = get_page_arguments()
+    postgres_info = get_postgres_page(after, limit)
+    next_after = None
+    if len(postgres_info) == limit:
+        next_after = postgres_info[-1]['id']
+    return render_template("postgres.html",
+                           postgres_data=postgres_info,
+                           next_after=next_after,
+                           limit=limit)
+
+
+# RESTful variant of the /get-postgres route. This returns the page as JSON,
+# or the whole table streamed in chunks when stream=1 is passed.
+@app.route("/get-postgres-rest")
+def get_postgres_rest():
     global POSTGRES
-    postgres_data = POSTGRES.run_query("SELECT * FROM DEMO")
-    postgres_info = list()
-    for row in postgres_data:
-        item = dict()
-        item['id'] = row[0]
-        item['key'] = row[1]
-        item['value'] = row[2]
-        postgres_info.append(item)
-    return render_template("postgres.html", postgres_data=postgres_info)
+    (after, limit) = get_page_arguments()
+    if request.args.get("stream") == "1":
+        (connected, error) = POSTGRES.check_status()
+        if not connected:
+            return make_response(json_response({'error': error}), 503)
+        rows = POSTGRES.iter_query(
+            "SELECT ID, USERNAME, EMAIL FROM DEMO WHERE ID > %s ORDER BY ID",
+            binding=(after,),
+            chunk_size=POSTGRES_STREAM_CHUNK)
+        # the first chunk is read before the response starts, so a query
+        # that fails right away still gets an error status
+        try:
+            first = next(rows, [])
+        except Exception:
+            return make_response(json_response(
+                {'error': "Failed to Stream the Query."}), 500)
+        return Response(stream_postgres_rows(first, rows),
+                        mimetype="application/json")
+
+    postgres_info = get_postgres_page(after, limit)
+    next_after = None
+    if len(postgres_info) == limit:
+        next_after = postgres_info[-1]['id']
+    return json_response({'data': postgres_info, 'next_after': next_after}), 200
+
+
+def get_page_arguments():
+    """
+        Read the keyset pagination arguments from the request.
+
+        @:return
+            after   -   Only rows with a greater ID are returned.
+            limit   -   Maximum rows on a page.
+    """
+    after = request.args.get("after", 0, type=int)
+    limit = request.args.get("limit", POSTGRES_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, POSTGRES_MAX_PAGE_SIZE))
+    return after, limit
+
+
+def get_postgres_page(after, limit):
+    """
+        Obtain a single page of the DEMO table using keyset pagination on
+        the ID column. This lets Postgres walk the primary key index
+        instead of scanning and discarding the rows before the page.
+    """
+    global POSTGRES
+    global CACHE
+
+    def load_page():
+        postgres_data = POSTGRES.run_query(
+            "SELECT ID, USERNAME, EMAIL FROM DEMO WHERE ID > %s "
+            "ORDER BY ID LIMIT %s",
+            binding=(after, limit))
+        if not isinstance(postgres_data, list):
+            return None
+        return [to_postgres_item(row) for row in postgres_data]
+
+    if CACHE is not None:
+        postgres_info = CACHE.get("page:%d:%d" % (after, limit), load_page)
+    else:
+        postgres_info = load_page()
+    if postgres_info is None:
+        return list()
+    return postgres_info
+
+
+def to_postgres_item(row):
+    """
+        Convert a DEMO row into the dictionary used by the templates.
+    """
+    item = dict()
+    item['id'] = row[0]
+    item['key'] = row[1]
+    item['value'] = row[2]
+    return item
+
+
+def stream_postgres_rows(first, rows):
+    """
+        Encode the chunks of DEMO rows into a JSON array one chunk at a time.
+        The status is sent by then, so a failure midway closes the array and
+        adds an error field to tell the client the data is partial.
+    """
+    yield '{"data":['
+    separator = ''
+    chunk = first
+    try:
+        while True:
+            if len(chunk) > 0:
+                yield separator + ','.join(
+                    [dumps(to_postgres_item(row)) for row in chunk])
+                separator = ','
+            chunk = next(rows)
+    except StopIteration:
+        yield ']}'
+    except Exception:
+        yield '],"error":"Failed to Stream the Query."}'
 
 
 """
@@ -333,18 +839,26 @@ def get_postgres():
 
 
 # Write an authentication mechanism that can be used to validate incoming
-# requests from the user. This is a basic authentication with static data.
+# requests from the user. The credentials come from the configuration and are
+# checked by a CredentialVerifier that caches the successful checks.
 def validate_credentials(username, password):
     """
-        Performs a basic MD5 based Authentication for both user and pass.
+        Validates the username and password against the configured hashes
+        using a constant time comparison.
     """
-    global AUTHENTICATION
-    md5user = md5.new(username)
-    md5pass = md5.new(password)
-    return AUTHENTICATION.get("username") == \
-        md5user.hexdigest() and \
-        AUTHENTICATION.get("password") \
-        == md5pass.hexdigest()
+    global VERIFIER
+    verifier = VERIFIER
+    if verifier is None:
+        with VERIFIER_LOCK:
+            if VERIFIER is None:
+                (auth_username, auth_password, cache_size,
+                 cache_ttl) = get_authentication_config()
+                VERIFIER = CredentialVerifier(auth_username,
+                                              auth_password,
+                                              cache_size=cache_size,
+                                              cache_ttl=cache_ttl)
+            verifier = VERIFIER
+    return verifier.verify(username, password)
 
 
 # Basic Function that Takes a Set of Authentication values in BASIC Auth mode
@@ -360,12 +874,13 @@ def authenticate_rest():
         "state": "success",
         "message": "Oh Captain, My Captain."
     }
-    return jsonify({'message': message}), 200
+    return json_response({'message': message}), 200
 
 
 # Micro-Services Example.
 # Micro Service Entry Point for the Function from UI.
 @app.route("/fibonacci")
+@PAGE_CACHE.cached
 def tasks():
     return render_template("fibonaci.html")
 
@@ -377,46 +892,336 @@ def fibonacci_post():
     with rpc_proxy() as task_proxy:
         task_id = task_proxy.start_task("fibonacci", number)
 
+    if task_id == "rejected":
+        return render_template("tasks.html", rejected=1), 503
     return render_template("tasks.html", task_id=task_id)
 
 
-# GET Even Handler that returns the Fibonacci Squence Value.
+# GET Even Handler that returns the Fibonacci Squence Value. The page shows
+# small values in full and the digit count, head and tail of the large ones.
+# ?mode= picks another output: decimal streams the full value as text,
+# digits, head, tail (?size= digits) and hex answer in JSON and binary
+# downloads the raw big-endian bytes.
 @app.route("/fibonacci-result/<string:task_id>")
 def fibonacci_result(task_id):
+    mode = request.args.get("mode")
+    if mode is None:
+        return fibonacci_result_page(task_id)
+    if mode not in RESULT_MODES + ("binary", ):
+        return make_response(
+            json_response({"error": "Unknown mode %s" % mode}), 400)
+
+    (_, edge_digits, _, chunk_size, _) = get_result_output_config()
+    size = request.args.get("size", edge_digits, type=int)
     with rpc_proxy() as task_proxy:
-        result = task_proxy.get_result(task_id)
-
-    return render_template("tasks_result.html", result=result)
-
-
-# the ServiceRpcProxy instance isn't thread safe so we constuct one for
-# each request; a more intelligent solution would be a thread-local or
-# pool of shared proxies
+        result = task_proxy.get_result(
+            task_id, HEX if mode == "binary" else mode, size)
+
+    if result in RESULT_STATUS_CODES:
+        return make_response(json_response(result_message(task_id, result)),
+                             RESULT_STATUS_CODES[result])
+    if mode == DECIMAL:
+        return Response(iter_chunks(result, chunk_size),
+                        mimetype="text/plain")
+    if mode == "binary":
+        response = Response(binascii.unhexlify(result),
+                            mimetype="application/octet-stream")
+        response.headers["Content-Disposition"] = \
+            "attachment; filename=fibonacci-%s.bin" % task_id
+        return response
+    return json_response(result_message(task_id, result))
+
+
+def fibonacci_result_page(task_id):
+    (preview_digits, edge_digits, _, _, _) = get_result_output_config()
+    with rpc_proxy() as task_proxy:
+        digits = task_proxy.get_result(task_id, DIGITS)
+        if digits in RESULT_STATUS_CODES:
+            return render_template("tasks_result.html", result=digits)
+        if digits <= preview_digits:
+            return render_template(
+                "tasks_result.html",
+                result=task_proxy.get_result(task_id, DECIMAL))
+        head = task_proxy.get_result(task_id, HEAD, edge_digits)
+        tail = task_proxy.get_result(task_id, TAIL, edge_digits)
+
+    return render_template("tasks_result.html", task_id=task_id,
+                           digits=digits, head=head, tail=tail)
+
+
+# Long-poll for the result of a task. The request is held until the result
+# is ready or `timeout` seconds pass, then answered with the status so the
+# client can ask again. ?mode= and ?size= are the JSON ones of
+# /fibonacci-result.
+@app.route("/fibonacci-result/<string:task_id>/wait")
+def fibonacci_result_wait(task_id):
+    (mode, size) = result_mode()
+    if mode is None:
+        return make_response(json_response({"error": "Unknown mode"}), 400)
+    if not acquire_wait_slot():
+        return wait_slots_busy()
+    try:
+        (max_wait, _, _, _, _) = get_task_wait_config()
+        timeout = request.args.get("timeout", max_wait, type=float)
+        with rpc_wait_proxy() as task_proxy:
+            result = task_proxy.wait_result(task_id, min(timeout, max_wait),
+                                            mode, size)
+    finally:
+        release_wait_slot()
+
+    response = json_response(result_message(task_id, result))
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+
+# Server-Sent Events stream for the result of a task. A comment is sent
+# every time a wait ends without the result to keep the connection open,
+# and a single result event once the task is done.
+@app.route("/fibonacci-result/<string:task_id>/events")
+def fibonacci_result_events(task_id):
+    (mode, size) = result_mode()
+    if mode is None:
+        return make_response(json_response({"error": "Unknown mode"}), 400)
+    if not acquire_wait_slot():
+        return wait_slots_busy()
+    (max_wait, _, _, _, _) = get_task_wait_config()
+    interval = min(request.args.get("interval", max_wait, type=float),
+                   max_wait)
+
+    def generate():
+        yield "retry: 2000\n\n"
+        while True:
+            with rpc_wait_proxy() as task_proxy:
+                result = task_proxy.wait_result(task_id, interval, mode,
+                                                size)
+            if result != PENDING:
+                break
+            yield ": pending\n\n"
+        yield "event: result\ndata: %s\n\n" % dumps(
+            result_message(task_id, result))
+
+    response = Response(generate(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    # the slot is held until the stream is closed, also when the client
+    # goes away before the first event
+    response.call_on_close(release_wait_slot)
+    return response
+
+
+# Each long-poll or event stream client holds a worker thread for the whole
+# wait. Past max_clients the clients are told to come back later, so they
+# can't starve the other routes.
+def acquire_wait_slot():
+    global WAIT_CLIENTS
+    (_, _, _, _, max_clients) = get_task_wait_config()
+    with WAIT_CLIENTS_LOCK:
+        if WAIT_CLIENTS >= max_clients:
+            return False
+        WAIT_CLIENTS += 1
+        return True
+
+
+def release_wait_slot():
+    global WAIT_CLIENTS
+    with WAIT_CLIENTS_LOCK:
+        WAIT_CLIENTS -= 1
+
+
+def wait_slots_busy():
+    response = make_response(json_response(
+        {"error": "Too many clients waiting on a result. Try again later."}),
+        503)
+    response.headers["Retry-After"] = "2"
+    return response
+
+
+# The status strings are sent as they are. A result comes as a string from
+# the TaskService, except for the digit count, since JavaScript loses the
+# precision of the large integers.
+def result_message(task_id, result):
+    if result in RESULT_STATUS_CODES:
+        return {"task_id": task_id, "status": result}
+    return {"task_id": task_id, "status": "ready", "result": result}
+
+
+# Output mode and size of the JSON result routes. The mode is None if it
+# isn't one of RESULT_MODES.
+def result_mode():
+    (_, edge_digits, _, _, _) = get_result_output_config()
+    mode = request.args.get("mode", DECIMAL)
+    size = request.args.get("size", edge_digits, type=int)
+    if mode not in RESULT_MODES:
+        return None, size
+    return mode, size
+
+
+# the ServiceRpcProxy instance isn't thread safe, so each request checks out
+# a proxy of its own from a shared pool and hands it back once done. The pool
+# is created lazily on the first call.
 def rpc_proxy():
-    URL = get_amqp_config()
-    config = {'AMQP_URI': URL}
-    return ServiceRpcProxy('tasks', config)
-
-
-# This section of the Code Starts-up your Flask Application.
-if __name__ == "__main__":
-    (flask_hostname, flask_port, flask_debug) = get_rest_information()
+    global RPC_POOL
+    if RPC_POOL is None:
+        with RPC_POOL_LOCK:
+            if RPC_POOL is None:
+                (size, idle_timeout, timeout) = get_rpc_pool_config()
+                RPC_POOL = RpcProxyPool('tasks',
+                                        {'AMQP_URI': get_amqp_config()},
+                                        size=size,
+                                        idle_timeout=idle_timeout,
+                                        timeout=timeout)
+    return RPC_POOL.acquire()
+
+
+# The waiting requests hold their proxy for up to max_wait seconds, so they
+# get a pool of their own and can't starve the other task routes. The reply
+# timeout leaves the TaskService a margin over max_wait to answer.
+def rpc_wait_proxy():
+    global RPC_WAIT_POOL
+    if RPC_WAIT_POOL is None:
+        with RPC_WAIT_POOL_LOCK:
+            if RPC_WAIT_POOL is None:
+                (max_wait, _, _, pool_size, _) = get_task_wait_config()
+                (_, idle_timeout, _) = get_rpc_pool_config()
+                RPC_WAIT_POOL = RpcProxyPool('tasks',
+                                             {'AMQP_URI': get_amqp_config()},
+                                             size=pool_size,
+                                             idle_timeout=idle_timeout,
+                                             timeout=max_wait + 5)
+    return RPC_WAIT_POOL.acquire()
+
+
+# Credentials may change on a config reload. The verifier is dropped so the
+# next request builds one with the new hashes.
+def reset_verifier(config):
+    global VERIFIER
+    with VERIFIER_LOCK:
+        VERIFIER = None
+
+
+# This function sets-up the REDIS, POSTGRES and the other handlers used by
+# the routes. Every server that runs this application must invoke it once per
+# process before serving any requests.
+def initialize(reload_signal=True):
+    """
+        Create the handler objects from the configuration. Handlers that
+        already exist are left untouched.
+
+        @:parameter
+            reload_signal   -   Install the handler of the config reload
+                                signal. Servers that reset the signal
+                                handlers after this, ex. gunicorn, install
+                                it later with install_reload_signal.
+    """
+    global REDIS
+    global POSTGRES
+    global COUNTER
+    global CACHE
+    global WRITER
+    global HEALTH
     (redis_hostname, redis_port, redis_password) = get_redis_config()
     (postgres_database, postgres_user, postgres_password,
      postgres_host, postgres_port) = get_postgresql_config()
+    (pool_min, pool_max, pool_idle_check, pool_retries,
+     pool_backoff) = get_postgresql_pool_config()
     if REDIS is None:
+        (redis_max_connections, redis_socket_timeout, redis_connect_timeout,
+         redis_retries, redis_backoff, redis_failure_threshold,
+         redis_reset_timeout) = get_redis_pool_config()
         REDIS = RedisHandler(
             host=redis_hostname,
             port=redis_port,
-            password=redis_password)
+            password=redis_password,
+            max_connections=redis_max_connections,
+            socket_timeout=redis_socket_timeout,
+            connect_timeout=redis_connect_timeout,
+            retries=redis_retries,
+            backoff=redis_backoff,
+            failure_threshold=redis_failure_threshold,
+            reset_timeout=redis_reset_timeout)
+
+    if COUNTER is None:
+        (counter_mode, counter_shard, counter_batch_size) = \
+            get_counter_config()
+        COUNTER = RedisCounter(REDIS,
+                               "inserts",
+                               mode=counter_mode,
+                               shard=counter_shard,
+                               batch_size=counter_batch_size)
 
     if POSTGRES is None:
         POSTGRES = PostgreSQL(database=postgres_database,
                               user=postgres_user,
                               password=postgres_password,
                               host=postgres_host,
-                              port=postgres_port)
+                              port=postgres_port,
+                              pool_min=pool_min,
+                              pool_max=pool_max,
+                              idle_check=pool_idle_check,
+                              retries=pool_retries,
+                              backoff=pool_backoff)
+
+    (cache_enabled, cache_ttl, cache_l1_size, cache_l1_ttl,
+     cache_version_ttl) = get_query_cache_config()
+    if CACHE is None and cache_enabled:
+        CACHE = QueryCache(REDIS,
+                           "pgcache:DEMO",
+                           ttl=cache_ttl,
+                           l1_size=cache_l1_size,
+                           l1_ttl=cache_l1_ttl,
+                           version_ttl=cache_version_ttl)
+
+    (write_mode, write_batch_size, write_flush_interval, write_max_queue,
+     write_redis_key, write_synchronous_commit, write_max_attempts,
+     write_max_dead_letters) = get_write_behind_config()
+    if WRITER is None and write_mode in ("memory", "redis"):
+        WRITER = WriteBehind(POSTGRES,
+                             BULK_INSERT_QUERY,
+                             mode=write_mode,
+                             redis=REDIS,
+                             redis_key=write_redis_key,
+                             batch_size=write_batch_size,
+                             flush_interval=write_flush_interval,
+                             max_queue=write_max_queue,
+                             synchronous_commit=write_synchronous_commit,
+                             on_flush=invalidate_postgres_cache,
+                             max_attempts=write_max_attempts,
+                             max_dead_letters=write_max_dead_letters)
+
+    if HEALTH is None:
+        (health_interval, health_timeout, health_stale_after) = \
+            get_health_config()
+        HEALTH = HealthMonitor(interval=health_interval,
+                               stale_after=health_stale_after)
+        HEALTH.add_probe("redis", redis_probe(REDIS))
+        HEALTH.add_probe("postgres", postgres_probe(POSTGRES))
+        HEALTH.add_probe("amqp", amqp_probe(get_amqp_config(),
+                                            timeout=health_timeout))
+        HEALTH.start()
+
+    (reload_interval, signal_name) = get_config_reload_config()
+    if reload_interval > 0 or signal_name:
+        add_reload_listener(reset_verifier)
+        enable_hot_reload(reload_interval)
+        if reload_signal:
+            install_reload_signal()
+
+
+# This function installs the handler of the config reload signal. It must be
+# invoked from the main thread, once the server is done with its own signal
+# handlers.
+def install_reload_signal():
+    (_, signal_name) = get_config_reload_config()
+    if signal_name:
+        enable_hot_reload(signal_name=signal_name)
+
+
+# This section of the Code Starts-up your Flask Application.
+if __name__ == "__main__":
+    (flask_hostname, flask_port, flask_debug) = get_rest_information()
+    initialize()
     app.run(
         host=flask_hostname,
         port=flask_port,
-        debug=flask_debug)
+        debug=flask_debug,
+        threaded=True)
@@ -0,0 +1,599 @@
+#!/usr/bin/python
+"""
+    This file is a load-testing and benchmark harness for the routes of the
+    Flask Application. The application is booted in-process against
+    in-memory stand-ins for its dependencies so that it can be run on any
+    machine without Redis, PostgreSQL or RabbitMQ.
+
+        REDIS       -   FakeRedis, an in-memory subset of StrictRedis.
+        POSTGRES    -   The PostgreSQL handler backed by SQLite in memory.
+        Nameko      -   An in-process task service stand-in for the pool of
+                        RPC proxies.
+
+    Requests are driven from a configurable number of threads using a
+    weighted mix of routes. Throughput and p50/p95/p99 latency are reported
+    and saved as JSON. Passing a previous run with --compare prints the
+    change for each route. --allocations adds the memory allocations, which
+    are measured in a separate pass since tracing them skews the timings.
+
+    Usage:
+        python benchmark.py --concurrency 8 --requests 5000 \\
+            --mix redis-rest-submit=4,get-redis=2,get-postgres=2 \\
+            --output benchmark_results.json --compare previous.json
+"""
+import argparse
+import base64
+import fnmatch
+import hashlib
+import itertools
+import json
+import random
+import re
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from timeit import default_timer
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import app
+import service
+from handle_auth import CredentialVerifier
+from handle_digits import render
+from handle_health import HealthMonitor, redis_probe, postgres_probe
+from handle_postgres import PostgreSQL
+from handle_redis import RedisHandler
+
+DEFAULT_MIX = "redis-rest-submit=4,get-redis=2,get-postgres=2," \
+    "fibonacci-submit=1,fibonacci-result=1"
+BENCH_USER = "bench"
+BENCH_PASSWORD = "bench"
+
+
+class FakePipeline(object):
+    """
+        Buffers the commands issued on a pipeline and runs them on execute.
+    """
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = list()
+
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+        return command
+
+    def execute(self):
+        with self.redis.lock:
+            results = [getattr(self.redis, name)(*args, **kwargs)
+                       for name, args, kwargs in self.commands]
+        self.commands = list()
+        return results
+
+
+class FakeRedis(object):
+    """
+        In-memory stand-in for the subset of StrictRedis used by the
+        RedisHandler. Expiry times are accepted and ignored.
+    """
+    def __init__(self):
+        self.data = dict()
+        self.lock = threading.RLock()
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def info(self):
+        return {"redis_version": "fake", "used_memory": 0}
+
+    def ping(self):
+        return True
+
+    def set(self, key, value, ex=None):
+        with self.lock:
+            self.data[key] = str(value)
+        return True
+
+    def get(self, key):
+        with self.lock:
+            return self.data.get(key)
+
+    def mset(self, mapping):
+        with self.lock:
+            for key, value in mapping.items():
+                self.data[key] = str(value)
+        return True
+
+    def mget(self, keys):
+        with self.lock:
+            return [self.data.get(key) for key in keys]
+
+    def delete(self, *keys):
+        with self.lock:
+            return len([self.data.pop(key) for key in keys
+                        if key in self.data])
+
+    def exists(self, key):
+        with self.lock:
+            return key in self.data
+
+    def incrby(self, key, amount=1):
+        with self.lock:
+            value = int(self.data.get(key, 0)) + amount
+            self.data[key] = str(value)
+            return value
+
+    def rpush(self, key, *values):
+        with self.lock:
+            self.data.setdefault(key, list()).extend(values)
+            return len(self.data[key])
+
+    def lpush(self, key, *values):
+        with self.lock:
+            items = self.data.setdefault(key, list())
+            for value in values:
+                items.insert(0, value)
+            return len(items)
+
+    def lrange(self, key, start, end):
+        with self.lock:
+            items = self.data.get(key, list())
+            if end == -1:
+                return list(items[start:])
+            return list(items[start:end + 1])
+
+    def ltrim(self, key, start, end):
+        with self.lock:
+            self.data[key] = self.lrange(key, start, end)
+            return True
+
+    def sadd(self, key, *values):
+        with self.lock:
+            self.data.setdefault(key, set()).update(values)
+            return len(values)
+
+    def smembers(self, key):
+        with self.lock:
+            return set(self.data.get(key, set()))
+
+    def hgetall(self, key):
+        with self.lock:
+            return dict(self.data.get(key, dict()))
+
+    def zrange(self, key, start, end, withscores=False):
+        return list()
+
+    def type(self, key):
+        with self.lock:
+            value = self.data.get(key)
+        if value is None:
+            return "none"
+        if isinstance(value, list):
+            return "list"
+        if isinstance(value, set):
+            return "set"
+        if isinstance(value, dict):
+            return "hash"
+        return "string"
+
+    def scan(self, cursor=0, match=None, count=10):
+        with self.lock:
+            keys = sorted(self.data)
+        page = keys[cursor:cursor + count]
+        next_cursor = cursor + count
+        if next_cursor >= len(keys):
+            next_cursor = 0
+        if match is not None:
+            page = [key for key in page if fnmatch.fnmatch(key, match)]
+        return next_cursor, page
+
+
+class FakeRedisHandler(RedisHandler):
+    """
+        RedisHandler running against FakeRedis.
+    """
+    def _RedisHandler__initialize(self):
+        self.redis = FakeRedis()
+        self.info = self.redis.info()
+
+
+class SqliteCursor(object):
+    """
+        Cursor adapter translating the psycopg2 queries used by the
+        PostgreSQL handler into SQLite ones.
+    """
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.itersize = 1000
+
+    def execute(self, query, binding=None):
+        query = re.sub(r"SERIAL\s+PRIMARY\s+KEY",
+                       "INTEGER PRIMARY KEY AUTOINCREMENT", query)
+        self.cursor.execute(query.replace("%s", "?"), binding or ())
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+class SqliteConnection(object):
+    """
+        Connection adapter exposing the psycopg2 connection surface used by
+        the PostgreSQL handler on top of an in-memory SQLite database.
+    """
+    closed = False
+
+    def __init__(self):
+        self.connection = sqlite3.connect(":memory:",
+                                          check_same_thread=False)
+
+    def cursor(self, name=None):
+        return SqliteCursor(self.connection.cursor())
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def close(self):
+        self.connection.close()
+
+
+class SqlitePostgreSQL(PostgreSQL):
+    """
+        PostgreSQL handler running in the single connection mode against an
+        in-memory SQLite database.
+    """
+    def _PostgreSQL__initialize(self):
+        self.postgres = SqliteConnection()
+        self.connected = True
+        self.cursor = self.postgres.cursor()
+        self._PostgreSQL__setup_demo_database(self.postgres)
+
+    def run_query_store_many(self, query_string, bindings,
+                             synchronous_commit=True):
+        if len(bindings) == 0:
+            return ""
+        placeholders = "(" + ", ".join(["?"] * len(bindings[0])) + ")"
+        try:
+            with self.connection() as connection:
+                connection.connection.executemany(
+                    query_string.replace("%s", placeholders), bindings)
+                connection.commit()
+            return ""
+        except sqlite3.Error as error:
+            self.error_found = True
+            self.error = "Failed to Execute the Batch Query." + str(error)
+            return self.error
+
+
+class FakeTaskProxy(object):
+    """
+        Stand-in for the nameko task service. Tasks run one at a time on a
+        background thread, like a single service container would.
+    """
+    def __init__(self):
+        self.results = dict()
+        self.tasks = queue.Queue()
+        self.lock = threading.Lock()
+        self.done = threading.Condition(self.lock)
+        worker = threading.Thread(target=self.__run)
+        worker.daemon = True
+        worker.start()
+
+    def __run(self):
+        while True:
+            (task_id, number) = self.tasks.get()
+            result = service.fibonacci_pair(max(number, 1), False)[0]
+            with self.lock:
+                self.results[task_id] = result
+                self.done.notify_all()
+
+    def start_task(self, name, number):
+        task_id = uuid.uuid4().hex
+        with self.lock:
+            self.results[task_id] = "pending"
+        self.tasks.put((task_id, number))
+        return task_id
+
+    def get_result(self, task_id, mode="value", size=None):
+        with self.lock:
+            result = self.results.get(task_id, "missing")
+        return render(result, mode, size or 50)
+
+    def wait_result(self, task_id, timeout, mode="value", size=None):
+        deadline = time.time() + timeout
+        with self.lock:
+            while self.results.get(task_id) == "pending" and \
+                    time.time() < deadline:
+                self.done.wait(deadline - time.time())
+        return self.get_result(task_id, mode, size)
+
+
+class FakeRpcPool(object):
+    """
+        Stand-in for the RpcProxyPool handing out the FakeTaskProxy.
+    """
+    def __init__(self):
+        self.proxy = FakeTaskProxy()
+
+    @contextmanager
+    def acquire(self):
+        yield self.proxy
+
+
+def boot(seed_rows):
+    """
+        Wire the Flask Application to the in-memory stand-ins and seed them
+        with seed_rows signups.
+    """
+    app.REDIS = FakeRedisHandler()
+    app.POSTGRES = SqlitePostgreSQL()
+    app.RPC_POOL = FakeRpcPool()
+    app.RPC_WAIT_POOL = app.RPC_POOL
+    app.VERIFIER = CredentialVerifier(
+        hashlib.md5(BENCH_USER.encode("utf-8")).hexdigest(),
+        hashlib.md5(BENCH_PASSWORD.encode("utf-8")).hexdigest())
+    app.HEALTH = HealthMonitor()
+    app.HEALTH.add_probe("redis", redis_probe(app.REDIS))
+    app.HEALTH.add_probe("postgres", postgres_probe(app.POSTGRES))
+    app.HEALTH.start()
+    app.initialize()
+    signups = [("seed%d" % index, "seed%d@example.com" % index)
+               for index in range(seed_rows)]
+    app.REDIS.add_many_to_redis(dict(signups))
+    app.POSTGRES.run_query_store_many(app.BULK_INSERT_QUERY, signups)
+
+
+class Driver(object):
+    """
+        Issues the requests of one route mix and records their latencies.
+    """
+    def __init__(self, fibonacci_n):
+        self.fibonacci_n = fibonacci_n
+        self.sequence = itertools.count()
+        self.task_ids = list()
+        self.lock = threading.Lock()
+        credentials = (BENCH_USER + ":" + BENCH_PASSWORD).encode("utf-8")
+        self.auth = {"Authorization": "Basic " +
+                     base64.b64encode(credentials).decode("ascii")}
+
+    def request(self, client, route):
+        """
+            Issue one request for route and return its status code.
+        """
+        if route == "redis-rest-submit":
+            index = next(self.sequence)
+            body = {
+                "redis": True,
+                "persist": True,
+                "payload": {"username": "user%d" % index,
+                            "email": "user%d@example.com" % index}
+            }
+            response = client.post("/redis-rest-submit",
+                                   data=json.dumps(body),
+                                   content_type="application/json",
+                                   headers=self.auth)
+        elif route == "get-redis":
+            response = client.get("/get-redis?limit=100")
+        elif route == "get-postgres":
+            response = client.get("/get-postgres?limit=100")
+        elif route == "fibonacci-submit":
+            response = client.post("/fibonacci-submit",
+                                   data={"number": str(self.fibonacci_n)})
+            match = re.search(r"/fibonacci-result/(\w+)",
+                              response.get_data(as_text=True))
+            if match is not None:
+                with self.lock:
+                    self.task_ids.append(match.group(1))
+        elif route == "fibonacci-result":
+            with self.lock:
+                task_id = self.task_ids[-1] if self.task_ids else "none"
+            response = client.get("/fibonacci-result/" + task_id)
+        elif route == "fibonacci-wait":
+            with self.lock:
+                task_id = self.task_ids[-1] if self.task_ids else "none"
+            response = client.get("/fibonacci-result/%s/wait?timeout=5"
+                                  % task_id)
+        else:
+            response = client.get("/" + route)
+        return response.status_code
+
+
+def percentile(values, fraction):
+    """
+        Nearest-rank percentile of a sorted list.
+    """
+    if len(values) == 0:
+        return None
+    index = int(round(fraction * (len(values) - 1)))
+    return values[index]
+
+
+def drive(concurrency, total, mix, fibonacci_n):
+    """
+        Drive total requests picked from mix across concurrency threads.
+
+        @:return
+            samples     -   Dictionary of the routes to their latencies.
+            errors      -   Dictionary of the routes to their 5xx count.
+            duration    -   Seconds taken by all the requests.
+    """
+    routes = list()
+    for route, weight in mix:
+        routes.extend([route] * weight)
+    driver = Driver(fibonacci_n)
+    samples = dict((route, list()) for route, _ in mix)
+    errors = dict((route, 0) for route, _ in mix)
+    remaining = itertools.count()
+    lock = threading.Lock()
+
+    def worker(seed):
+        randomizer = random.Random(seed)
+        client = app.app.test_client()
+        while next(remaining) < total:
+            route = randomizer.choice(routes)
+            started = default_timer()
+            status = driver.request(client, route)
+            elapsed = default_timer() - started
+            with lock:
+                samples[route].append(elapsed)
+                if status >= 500:
+                    errors[route] += 1
+
+    started = default_timer()
+    threads = [threading.Thread(target=worker, args=(index,))
+               for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, errors, default_timer() - started
+
+
+def measure_allocations(concurrency, total, mix, fibonacci_n):
+    """
+        Drive a separate pass with tracemalloc on. Tracing slows down every
+        allocation, so it is kept out of the timed run.
+
+        @:return
+            allocations -   Dictionary with the net and peak bytes, or None
+                            without tracemalloc.
+    """
+    if tracemalloc is None:
+        return None
+    tracemalloc.start()
+    try:
+        drive(concurrency, total, mix, fibonacci_n)
+        (current, peak) = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"net_bytes": current, "peak_bytes": peak}
+
+
+def run(concurrency, total, mix, fibonacci_n, allocations=False):
+    """
+        Drive total requests picked from mix across concurrency threads and
+        report on them.
+
+        @:parameter
+            allocations -   Also measure the memory allocations, in a pass
+                            of their own after the timed one.
+
+        @:return
+            report      -   Dictionary with overall and per route figures.
+    """
+    (samples, errors, duration) = drive(concurrency, total, mix,
+                                        fibonacci_n)
+    report = {
+        "concurrency": concurrency,
+        "requests": total,
+        "duration": duration,
+        "throughput": total / duration,
+        "allocations": None,
+        "python": sys.version.split()[0],
+        "routes": dict()
+    }
+    for route, latencies in samples.items():
+        latencies.sort()
+        report["routes"][route] = {
+            "requests": len(latencies),
+            "errors": errors[route],
+            "throughput": len(latencies) / duration,
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99)
+        }
+    if allocations:
+        report["allocations"] = measure_allocations(
+            concurrency, total, mix, fibonacci_n)
+    return report
+
+
+def compare(report, previous):
+    """
+        Print the change of each route against a previous report.
+    """
+    print("%-20s %12s %12s %12s" % ("route", "throughput", "p95", "p99"))
+    for route, current in sorted(report["routes"].items()):
+        before = previous.get("routes", dict()).get(route)
+        if before is None or not before.get("requests"):
+            continue
+        changes = list()
+        for key in ("throughput", "p95", "p99"):
+            if before.get(key) and current.get(key) is not None:
+                changes.append("%+11.1f%%" % (
+                    (current[key] - before[key]) * 100.0 / before[key]))
+            else:
+                changes.append("%12s" % "n/a")
+        print("%-20s %s %s %s" % tuple([route] + changes))
+
+
+def parse_mix(value):
+    """
+        Parse route=weight pairs separated by commas.
+    """
+    mix = list()
+    for item in value.split(","):
+        (route, _, weight) = item.partition("=")
+        mix.append((route.strip(), int(weight or 1)))
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--fibonacci-n", type=int, default=10000)
+    parser.add_argument("--seed-rows", type=int, default=1000)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", default=None)
+    parser.add_argument("--allocations", action="store_true",
+                        help="measure the memory allocations in an extra, "
+                             "untimed pass")
+    arguments = parser.parse_args()
+
+    boot(arguments.seed_rows)
+    report = run(arguments.concurrency,
+                 arguments.requests,
+                 parse_mix(arguments.mix),
+                 arguments.fibonacci_n,
+                 arguments.allocations)
+    with open(arguments.output, "w") as output:
+        json.dump(report, output, indent=2, sort_keys=True)
+
+    print("%d requests in %.2fs, %.1f req/s" % (
+        report["requests"], report["duration"], report["throughput"]))
+    print("%-20s %8s %8s %10s %10s %10s" % (
+        "route", "requests", "errors", "p50 (ms)", "p95 (ms)", "p99 (ms)"))
+    for route, figures in sorted(report["routes"].items()):
+        if figures["requests"] == 0:
+            continue
+        print("%-20s %8d %8d %10.2f %10.2f %10.2f" % (
+            route, figures["requests"], figures["errors"],
+            figures["p50"] * 1000, figures["p95"] * 1000,
+            figures["p99"] * 1000))
+    if report["allocations"] is not None:
+        print("allocations: peak %(peak_bytes)d bytes, "
+              "net %(net_bytes)d bytes" % report["allocations"])
+
+    if arguments.compare is not None:
+        with open(arguments.compare) as previous:
+            compare(report, json.load(previous))
+
+
+if __name__ == "__main__":
+    main()
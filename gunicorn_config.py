@@ -0,0 +1,58 @@
+#!/usr/bin/python
+"""
+    This file is the configuration for running the Flask Application with
+    multiple worker processes under gunicorn.
+
+    The application is imported once in the master process (preload) and
+    the workers are forked from it. The REDIS, POSTGRES and the other
+    handlers are only created in the post_fork hook, so every worker opens
+    connections of its own and none are shared across the fork.
+
+    Usage:
+        gunicorn -c gunicorn_config.py app:app
+
+    Send a HUP to the master process to gracefully reload the workers. The
+    CONFIG_RELOAD_SIGNAL (ex. SIGUSR2) must be sent to the worker processes
+    instead. Sent to the master, SIGUSR2 starts a binary upgrade.
+"""
+from config import get_rest_information, get_worker_config
+
+(hostname, port, debug) = get_rest_information()
+(workers, threads, max_requests, max_requests_jitter, timeout,
+ graceful_timeout) = get_worker_config()
+
+bind = "%s:%d" % (hostname, port)
+worker_class = "gthread"
+preload_app = True
+loglevel = "debug" if debug else "info"
+
+
+def post_fork(server, worker):
+    """
+        Create the handlers in each worker once it is forked.
+    """
+    import app
+    app.initialize(reload_signal=False)
+
+
+def post_worker_init(worker):
+    """
+        Install the config reload signal handler in each worker. The worker
+        resets the signal handlers after post_fork, so it can't be done
+        there.
+    """
+    import app
+    app.install_reload_signal()
+
+
+def worker_exit(server, worker):
+    """
+        Drain the write-behind queue and give back the unused counter range
+        before a worker goes away, ex. when it is recycled or on a graceful
+        reload.
+    """
+    import app
+    if app.WRITER is not None:
+        app.WRITER.close()
+    if app.COUNTER is not None:
+        app.COUNTER.close()
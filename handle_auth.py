@@ -0,0 +1,136 @@
+#!/usr/bin/python
+"""
+    This file takes care of verifying the Basic Auth credentials that come
+    in with the RESTful requests.
+
+    The stored credentials are hashes. Both legacy MD5 hex digests and
+    salted PBKDF2 hashes are supported. PBKDF2 is deliberately slow, so the
+    Authorization headers that verified successfully are cached for a short
+    while and the cost is only paid once per cache miss.
+"""
+import binascii
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+
+PBKDF2_PREFIX = "pbkdf2_sha256"
+
+
+def to_bytes(value):
+    """
+        Encode text into bytes for hashing.
+    """
+    if isinstance(value, bytes):
+        return value
+    return value.encode("utf-8")
+
+
+def hash_credential(value, iterations=100000, salt=None):
+    """
+        Generate the stored form of a credential using PBKDF2-SHA256.
+
+        @:parameter
+            value       -   Username or Password to Hash.
+            iterations  -   PBKDF2 iteration count.
+            salt        -   Optional salt. A random one is used by default.
+
+        @:return
+            hashed      -   pbkdf2_sha256$<iterations>$<salt>$<hex digest>
+    """
+    if salt is None:
+        salt = binascii.hexlify(os.urandom(16)).decode("ascii")
+    digest = hashlib.pbkdf2_hmac(
+        "sha256", to_bytes(value), to_bytes(salt), iterations)
+    return "%s$%d$%s$%s" % (PBKDF2_PREFIX, iterations, salt,
+                            binascii.hexlify(digest).decode("ascii"))
+
+
+def check_credential(value, hashed):
+    """
+        Check a credential against its stored form using a constant time
+        comparison.
+
+        @:parameter
+            value   -   Credential sent by the client.
+            hashed  -   Stored MD5 hex digest or PBKDF2 hash.
+    """
+    if hashed.startswith(PBKDF2_PREFIX + "$"):
+        (_, iterations, salt, expected) = hashed.split("$", 3)
+        digest = hashlib.pbkdf2_hmac(
+            "sha256", to_bytes(value), to_bytes(salt), int(iterations))
+    else:
+        expected = hashed
+        digest = hashlib.md5(to_bytes(value)).digest()
+    return hmac.compare_digest(
+        binascii.hexlify(digest), to_bytes(expected.lower()))
+
+
+class CredentialVerifier(object):
+    """
+        This is the class that verifies a username and password pair and
+        keeps a bounded, expiring cache of the pairs that verified.
+    """
+    def __init__(self, username, password, cache_size=1024, cache_ttl=300):
+        """
+            Constructor Function.
+
+            @:parameter
+                username    -   Stored hash of the username.
+                password    -   Stored hash of the password.
+                cache_size  -   Maximum number of cached verifications.
+                cache_ttl   -   Seconds a verification stays cached.
+        """
+        self.username = username
+        self.password = password
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        # per process key, so the cache never holds the raw credentials
+        self.key = os.urandom(32)
+
+    def verify(self, username, password):
+        """
+            Verify a username and password pair.
+
+            @:return
+                True    -   Valid Credentials.
+                False   -   Invalid Credentials.
+        """
+        cache_key = hmac.new(
+            self.key,
+            to_bytes(username) + b"\0" + to_bytes(password),
+            hashlib.sha256).digest()
+        now = time.time()
+        with self.lock:
+            expires = self.cache.get(cache_key)
+            if expires is not None:
+                del self.cache[cache_key]
+                if expires > now:
+                    # put it back as the most recently used one
+                    self.cache[cache_key] = expires
+                    return True
+
+        # check both the parts so the time taken doesn't reveal which one
+        # of them was wrong. Only the successful checks are cached.
+        valid_username = check_credential(username, self.username)
+        valid_password = check_credential(password, self.password)
+        if not (valid_username and valid_password):
+            return False
+
+        with self.lock:
+            self.cache[cache_key] = now + self.cache_ttl
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return True
+
+    def clear(self):
+        """
+            Drop all the cached verifications. Used when the credentials
+            change.
+        """
+        with self.lock:
+            self.cache.clear()
@@ -0,0 +1,120 @@
+#!/usr/bin/python
+"""
+    This file takes care of failing fast while a dependency is down.
+
+    The circuit breaker starts closed and lets every call through. Once
+    failure_threshold calls in a row have failed it opens and rejects all
+    the calls without trying, for reset_timeout seconds. After that it is
+    half-open and lets a single trial call through. The breaker closes
+    again if the trial succeeds and opens for another reset_timeout if it
+    fails.
+"""
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitOpenError(Exception):
+    """
+        Raised for the calls rejected while the circuit is open.
+    """
+    pass
+
+
+class CircuitBreaker(object):
+    """
+        This is the class that tracks the failures of the calls to a single
+        dependency and decides if the next call may go through.
+    """
+    def __init__(self, failure_threshold=5, reset_timeout=5.0):
+        """
+            Constructor Function.
+
+            @:parameter
+                failure_threshold   -   Failures in a row that open the
+                                        circuit.
+                reset_timeout       -   Seconds the circuit stays open
+                                        before a trial call is let through.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.trial = False
+        self.opened = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """
+            Check if a call may go through. While half-open only the first
+            caller gets to make the trial call.
+
+            @:return
+                allowed -   False if the call must fail fast.
+        """
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and \
+                    time.time() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self.trial = False
+            if self.state == HALF_OPEN and not self.trial:
+                self.trial = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        """
+            Record a call that reached the dependency.
+        """
+        with self.lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.trial = False
+
+    def record_failure(self):
+        """
+            Record a call that couldn't reach the dependency.
+        """
+        with self.lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or \
+                    self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.opened += 1
+                self.state = OPEN
+                self.opened_at = time.time()
+                self.trial = False
+
+    def is_open(self):
+        """
+            Check if calls are currently rejected. An open circuit whose
+            reset_timeout has passed doesn't count as open.
+        """
+        with self.lock:
+            return self.state == OPEN and \
+                time.time() - self.opened_at < self.reset_timeout
+
+    def get_stats(self):
+        """
+            Obtain the state of the breaker.
+
+            @:return
+                stats   -   Dictionary with the state, the failures in a row
+                            and the times the circuit opened and rejected a
+                            call.
+        """
+        with self.lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "opened": self.opened,
+                "rejected": self.rejected
+            }
@@ -0,0 +1,189 @@
+#!/usr/bin/python
+"""
+    This file takes care of caching the results of the read queries that
+    run against PostgreSQL. Results are cached in two levels. A small LRU
+    in the process memory in front of a shared cache in Redis.
+
+    Every cache key carries a version number kept in Redis. Writers bump
+    the version after each commit, which makes all the previously cached
+    results unreachable at once instead of deleting them one by one.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+class QueryCache(object):
+    """
+        This is the class that provides a read-through cache for the query
+        results of a single table.
+    """
+    def __init__(self, redis, namespace, ttl=60, l1_size=256, l1_ttl=5,
+                 version_ttl=1.0):
+        """
+            Constructor Function.
+
+            @:parameter
+                redis       -   RedisHandler for the shared cache.
+                namespace   -   Prefix for the Redis keys. Ex: pgcache:DEMO
+                ttl         -   Seconds a result is kept in Redis.
+                l1_size     -   Results kept in the process memory.
+                l1_ttl      -   Seconds a result is kept in process memory.
+                version_ttl -   Seconds the version number is trusted before
+                                it is read from Redis again. This bounds for
+                                how long a write made by another process can
+                                go unnoticed.
+        """
+        self.redis = redis
+        self.namespace = namespace
+        self.ttl = ttl
+        self.l1_size = l1_size
+        self.l1_ttl = l1_ttl
+        self.version_ttl = version_ttl
+        self.l1 = OrderedDict()
+        self.lock = threading.Lock()
+        self.loading = dict()
+        self.version = None
+        self.version_read_at = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __version_key(self):
+        return self.namespace + ":version"
+
+    def __current_version(self):
+        """
+            Obtain the current version, reading it from Redis at most once
+            every version_ttl seconds.
+
+            @:return
+                version -   Version number or None if Redis is unreachable.
+        """
+        now = time.time()
+        with self.lock:
+            if self.version is not None and \
+                    now - self.version_read_at < self.version_ttl:
+                return self.version
+        value = self.redis.get_from_redis(self.__version_key(), auth=True)
+        if value is False:
+            self.redis.reset_error()
+            return None
+        if isinstance(value, bytes):
+            value = value.decode("utf-8")
+        with self.lock:
+            self.version = str(value or 0)
+            self.version_read_at = now
+            return self.version
+
+    def __count(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def __get_local(self, cache_key):
+        with self.lock:
+            entry = self.l1.get(cache_key)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self.l1[cache_key]
+                return None
+            self.l1.pop(cache_key)
+            self.l1[cache_key] = entry
+            self.hits += 1
+            return entry
+
+    def __put_local(self, cache_key, value):
+        with self.lock:
+            self.l1.pop(cache_key, None)
+            self.l1[cache_key] = (value, time.time() + self.l1_ttl)
+            while len(self.l1) > self.l1_size:
+                self.l1.popitem(last=False)
+
+    def get(self, key, loader):
+        """
+            Obtain the result for a key, invoking loader on a cache miss.
+            Concurrent misses on the same key within this process share a
+            single invocation of loader.
+
+            @:parameter
+                key     -   Identifies the query. Ex: page:0:100
+                loader  -   Callable that runs the query. Results must be
+                            JSON serializable. A None result isn't cached.
+
+            @:return
+                value   -   Cached or freshly loaded result.
+        """
+        version = self.__current_version()
+        if version is None:
+            return loader()
+        cache_key = self.namespace + ":v" + version + ":" + key
+
+        entry = self.__get_local(cache_key)
+        if entry is not None:
+            return entry[0]
+
+        with self.lock:
+            loading = self.loading.get(cache_key)
+            leader = loading is None
+            if leader:
+                loading = threading.Event()
+                self.loading[cache_key] = loading
+        if not leader:
+            loading.wait()
+            entry = self.__get_local(cache_key)
+            if entry is not None:
+                return entry[0]
+            return loader()
+
+        try:
+            value = self.redis.get_from_redis(cache_key, auth=True)
+            if value is not None and value is not False:
+                self.__count(hit=True)
+                value = json.loads(value)
+                self.__put_local(cache_key, value)
+                return value
+            self.redis.reset_error()
+
+            self.__count(hit=False)
+            value = loader()
+            if value is not None:
+                self.redis.add_to_redis(
+                    cache_key, json.dumps(value), expire=self.ttl)
+                self.redis.reset_error()
+                self.__put_local(cache_key, value)
+            return value
+        finally:
+            with self.lock:
+                del self.loading[cache_key]
+            loading.set()
+
+    def invalidate(self):
+        """
+            Bump the version so that no reader gets the results cached so
+            far. Invoked after every write to the table.
+        """
+        version = self.redis.incr_counter(self.__version_key())
+        with self.lock:
+            self.l1.clear()
+            if version is None:
+                self.version = None
+            else:
+                self.version = str(version)
+                self.version_read_at = time.time()
+        self.redis.reset_error()
+
+    def get_stats(self):
+        """
+            Obtain the hit and miss counts of the cache.
+        """
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "l1_entries": len(self.l1),
+                "version": self.version
+            }
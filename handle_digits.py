@@ -0,0 +1,222 @@
+#!/usr/bin/python
+"""
+    This file takes care of writing out the huge integers returned by the
+    tasks.
+
+    CPython converts an integer to its decimal form in quadratic time and,
+    since Python 3.11, refuses to convert one with more than 4300 digits.
+    The decimal form is worked out with gmpy2 when it is installed and
+    otherwise by splitting the integer in halves and joining them back with
+    the C decimal module, whose multiplication is subquadratic. Python 2
+    has neither the limit nor a fast decimal module and uses str().
+
+    The other output modes avoid the full conversion: the digit count comes
+    from the bit length, the leading digits from the top bits, the trailing
+    ones from a remainder and the hexadecimal form is linear.
+"""
+import math
+
+try:
+    import gmpy2
+except ImportError:
+    gmpy2 = None
+
+try:
+    import _decimal as cdecimal
+except ImportError:
+    cdecimal = None
+
+try:
+    long
+except NameError:
+    long = int
+
+VALUE = "value"
+DECIMAL = "decimal"
+DIGITS = "digits"
+HEAD = "head"
+TAIL = "tail"
+HEX = "hex"
+MODES = (VALUE, DECIMAL, DIGITS, HEAD, TAIL, HEX)
+
+# integers up to this many bits are converted by the decimal module itself
+SPLIT_BITS = 4096
+# units in the last of the guard digits the leading digits may be off by
+GUARD_MARGIN = 1000
+
+
+def to_decimal(value):
+    """
+        Convert an integer to its decimal form in subquadratic time.
+
+        @:parameter
+            value   -   Integer to Convert.
+
+        @:return
+            decimal -   Decimal digits of the integer as a string.
+    """
+    if gmpy2 is not None:
+        return gmpy2.mpz(value).digits(10)
+    if cdecimal is None or value.bit_length() <= SPLIT_BITS:
+        return str(value)
+    if value < 0:
+        return "-" + to_decimal(-value)
+
+    powers = dict()
+
+    def power(bits):
+        # 2 ** bits as a Decimal, built from the powers already worked out
+        result = powers.get(bits)
+        if result is None:
+            if bits <= SPLIT_BITS:
+                result = cdecimal.Decimal(1 << bits)
+            else:
+                half = bits >> 1
+                result = power(half) * power(bits - half)
+            powers[bits] = result
+        return result
+
+    def convert(part, bits):
+        if bits <= SPLIT_BITS:
+            return cdecimal.Decimal(part)
+        half = bits >> 1
+        high = part >> half
+        low = part - (high << half)
+        return convert(high, bits - half) * power(half) + convert(low, half)
+
+    with cdecimal.localcontext() as context:
+        context.prec = cdecimal.MAX_PREC
+        context.Emax = cdecimal.MAX_EMAX
+        context.Emin = cdecimal.MIN_EMIN
+        context.traps[cdecimal.Inexact] = True
+        return str(convert(value, value.bit_length()))
+
+
+def count_digits(value):
+    """
+        Count the decimal digits of an integer without converting it.
+
+        @:parameter
+            value   -   Integer to Count the digits of.
+
+        @:return
+            digits  -   Number of decimal digits, leaving out the sign.
+    """
+    value = abs(value)
+    if value < 10:
+        return 1
+    # log10 from the top 64 bits is enough unless the value is very close
+    # to a power of ten, which is then checked exactly
+    shift = max(value.bit_length() - 64, 0)
+    estimate = math.log10(value >> shift) + shift * math.log10(2)
+    digits = int(estimate) + 1
+    if abs(estimate - round(estimate)) < 1e-6:
+        digits = int(round(estimate))
+        if value >= 10 ** digits:
+            digits += 1
+    return digits
+
+
+def leading_digits(value, size):
+    """
+        Obtain the first size decimal digits of an integer.
+
+        @:parameter
+            value   -   Integer to Read.
+            size    -   Number of digits.
+    """
+    value = abs(value)
+    precision = size + 20
+    shift = value.bit_length() - int(precision * 3.33) - 16
+    if cdecimal is not None and shift > 0:
+        # the top bits times 2 ** shift, to precision digits. This is off by
+        # a few units in the last digit at most, so the first size digits
+        # are exact unless the guard digits beyond them are close to a
+        # carry either way
+        with cdecimal.localcontext() as context:
+            context.prec = precision
+            context.rounding = cdecimal.ROUND_DOWN
+            context.Emax = cdecimal.MAX_EMAX
+            estimate = cdecimal.Decimal(value >> shift) * \
+                cdecimal.Decimal(2) ** shift
+        coefficient = "".join([str(digit)
+                               for digit in estimate.as_tuple().digits])
+        guard = int(coefficient[size:] or "0")
+        if len(coefficient) == precision and \
+                GUARD_MARGIN <= guard <= 10 ** 20 - GUARD_MARGIN:
+            return coefficient[:size]
+    digits = count_digits(value)
+    if digits > size:
+        value //= 10 ** (digits - size)
+    return to_decimal(value)
+
+
+def trailing_digits(value, size):
+    """
+        Obtain the last size decimal digits of an integer, keeping the
+        leading zeros of that part.
+
+        @:parameter
+            value   -   Integer to Read.
+            size    -   Number of digits.
+    """
+    value = abs(value)
+    power = 10 ** size
+    if value < power:
+        return to_decimal(value)
+    return to_decimal(value % power).zfill(size)
+
+
+def to_hex(value):
+    """
+        Convert an integer to its hexadecimal form, with an even number of
+        digits so that it unhexlifies into whole bytes.
+    """
+    digits = "%x" % abs(value)
+    if len(digits) % 2:
+        digits = "0" + digits
+    if value < 0:
+        return "-" + digits
+    return digits
+
+
+def render(value, mode=VALUE, size=50):
+    """
+        Write out a task result in one of the output modes. Results that
+        aren't integers are returned as they are.
+
+        @:parameter
+            value   -   Task Result.
+            mode    -   One of MODES. value returns the integer itself.
+            size    -   Number of digits for the head and tail modes.
+
+        @:return
+            output  -   Integer for the value and digits modes, string for
+                        the others.
+    """
+    if mode not in MODES:
+        raise ValueError("Unknown output mode %r" % (mode, ))
+    if mode == VALUE or isinstance(value, bool) or \
+            not isinstance(value, (int, long)):
+        return value
+    if mode == DECIMAL:
+        return to_decimal(value)
+    if mode == DIGITS:
+        return count_digits(value)
+    if mode == HEAD:
+        return leading_digits(value, size)
+    if mode == TAIL:
+        return trailing_digits(value, size)
+    return to_hex(value)
+
+
+def iter_chunks(text, size=65536):
+    """
+        Split a long string into chunks for a streamed response.
+
+        @:parameter
+            text    -   String to Split.
+            size    -   Characters in each chunk.
+    """
+    for start in range(0, len(text), size):
+        yield text[start:start + size]
@@ -0,0 +1,213 @@
+#!/usr/bin/python
+"""
+    This file takes care of encoding the responses of the application.
+
+    JSON is written with the fastest encoder that is installed. ujson and
+    simplejson are used when available and the standard json module
+    otherwise. The output is compact unless a pretty one is asked for.
+
+    Responses are compressed with gzip or deflate when the client accepts
+    it and the body is large enough to be worth it. Streamed responses are
+    compressed on the fly, chunk by chunk.
+"""
+import json
+import threading
+import zlib
+from collections import OrderedDict
+
+try:
+    import ujson as fast_json
+except ImportError:
+    try:
+        import simplejson as fast_json
+    except ImportError:
+        fast_json = None
+
+try:
+    text_type = unicode
+except NameError:
+    text_type = str
+
+COMPRESSIBLE_TYPES = ("application/json", "application/javascript",
+                      "application/xml", "image/svg+xml")
+
+
+def dumps(value, pretty=False):
+    """
+        Encode a value into JSON.
+
+        @:parameter
+            value   -   Value to Encode.
+            pretty  -   Indent the output and sort the keys for reading.
+
+        @:return
+            json    -   JSON string.
+    """
+    if pretty:
+        return json.dumps(value, sort_keys=True, indent=4,
+                          separators=(',', ': '))
+    if fast_json is not None:
+        try:
+            if fast_json.__name__ == "ujson":
+                return fast_json.dumps(value, escape_forward_slashes=False)
+            return fast_json.dumps(value, separators=(',', ':'))
+        except (TypeError, ValueError, OverflowError):
+            # ujson gives up on values the standard module can encode.
+            # Ex: integers beyond 64 bits.
+            pass
+    return json.dumps(value, separators=(',', ':'))
+
+
+def negotiate(accept_encoding):
+    """
+        Pick the content coding for an Accept-Encoding header.
+
+        @:return
+            coding  -   gzip, deflate or None if neither is accepted.
+    """
+    accepted = dict()
+    for item in accept_encoding.split(","):
+        parts = item.strip().split(";")
+        coding = parts[0].strip().lower()
+        quality = 1.0
+        for parameter in parts[1:]:
+            (name, _, value) = parameter.strip().partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            accepted[coding] = quality
+    for coding in ("gzip", "deflate"):
+        quality = accepted.get(coding, accepted.get("*", 0.0))
+        if quality > 0:
+            return coding
+    return None
+
+
+class Compressor(object):
+    """
+        This is the class that compresses the responses sent to the clients
+        that accept it.
+    """
+    def __init__(self, enabled=True, min_size=1024, level=6,
+                 flush_size=16384, cache_entries=128):
+        """
+            Constructor Function.
+
+            @:parameter
+                enabled         -   Setting this to False sends all the
+                                    responses as they are.
+                min_size        -   Bodies smaller than this many bytes are
+                                    sent uncompressed.
+                level           -   zlib compression level, 1 to 9.
+                flush_size      -   Bytes of a streamed body gathered before
+                                    the compressed data is sent out.
+                cache_entries   -   Compressed bodies of the responses that
+                                    carry an ETag kept for reuse.
+        """
+        self.enabled = enabled
+        self.min_size = min_size
+        self.level = level
+        self.flush_size = flush_size
+        self.cache_entries = cache_entries
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __compressobj(self, coding):
+        if coding == "gzip":
+            return zlib.compressobj(self.level, zlib.DEFLATED,
+                                    16 + zlib.MAX_WBITS)
+        return zlib.compressobj(self.level, zlib.DEFLATED, zlib.MAX_WBITS)
+
+    def __compress(self, body, coding, etag):
+        """
+            Compress a whole body. Bodies with an ETag are the same every
+            time, so their compressed form is kept and reused.
+        """
+        key = (etag, coding)
+        if etag is not None:
+            with self.lock:
+                compressed = self.cache.get(key)
+                if compressed is not None:
+                    self.cache.pop(key)
+                    self.cache[key] = compressed
+                    return compressed
+        compressor = self.__compressobj(coding)
+        compressed = compressor.compress(body) + compressor.flush()
+        if etag is not None:
+            with self.lock:
+                self.cache[key] = compressed
+                while len(self.cache) > self.cache_entries:
+                    self.cache.popitem(last=False)
+        return compressed
+
+    def __stream(self, chunks, coding):
+        """
+            Compress a streamed body on the fly. The compressed data is
+            flushed out once flush_size bytes have gone in, so the client
+            keeps receiving data as it is produced.
+        """
+        compressor = self.__compressobj(coding)
+        pending = 0
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, text_type):
+                    chunk = chunk.encode("utf-8")
+                data = compressor.compress(chunk)
+                pending += len(chunk)
+                if pending >= self.flush_size:
+                    data += compressor.flush(zlib.Z_SYNC_FLUSH)
+                    pending = 0
+                if data:
+                    yield data
+            yield compressor.flush()
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+
+    def compress(self, response, accept_encoding):
+        """
+            Compress a response if the client accepts it.
+
+            @:parameter
+                response        -   Flask Response.
+                accept_encoding -   Accept-Encoding header of the request.
+
+            @:return
+                response        -   The same Response, compressed or not.
+        """
+        if not self.enabled or response.direct_passthrough or \
+                response.status_code < 200 or \
+                response.status_code in (204, 206, 304) or \
+                "Content-Encoding" in response.headers:
+            return response
+        mimetype = response.mimetype or ""
+        if not mimetype.startswith("text/") and \
+                mimetype not in COMPRESSIBLE_TYPES:
+            return response
+        if mimetype == "text/event-stream":
+            # the events must reach the client as soon as they are sent
+            return response
+        response.vary.add("Accept-Encoding")
+        coding = negotiate(accept_encoding or "")
+        if coding is None:
+            return response
+
+        (etag, weak) = response.get_etag()
+        if response.is_streamed:
+            response.response = self.__stream(response.response, coding)
+            response.headers.pop("Content-Length", None)
+        else:
+            body = response.get_data()
+            if len(body) < self.min_size:
+                return response
+            response.set_data(self.__compress(body, coding, etag))
+        response.headers["Content-Encoding"] = coding
+        if etag is not None:
+            # the compressed body differs byte for byte, but it is the same
+            # resource, so the ETag still validates as a weak one.
+            response.set_etag(etag, weak=True)
+        return response
@@ -0,0 +1,172 @@
+#!/usr/bin/python
+"""
+    This file takes care of checking the dependencies of the application
+    for the /healthz and /readyz routes.
+
+    REDIS, PostgreSQL and the AMQP broker are probed from a background
+    thread every few seconds and the outcome is cached. The routes only
+    read the cached results, so a health check never waits on a dependency
+    and never adds load on it beyond the periodic probe.
+"""
+import threading
+import time
+from timeit import default_timer
+
+from kombu import Connection
+
+UP = "up"
+DOWN = "down"
+
+
+def redis_probe(handler):
+    """
+        Probe that sends a PING to REDIS.
+
+        @:parameter
+            handler -   RedisHandler to Probe.
+    """
+    def probe():
+        handler.get_connection().ping()
+    return probe
+
+
+def postgres_probe(handler):
+    """
+        Probe that runs SELECT 1 on a PostgreSQL connection.
+
+        @:parameter
+            handler -   PostgreSQL Handler to Probe.
+    """
+    def probe():
+        handler.ping()
+    return probe
+
+
+def amqp_probe(uri, timeout=2.0):
+    """
+        Probe that opens and closes a connection to the AMQP broker.
+
+        @:parameter
+            uri     -   AMQP URI of the broker.
+            timeout -   Seconds to wait for the connection.
+    """
+    def probe():
+        connection = Connection(uri, connect_timeout=timeout)
+        try:
+            connection.connect()
+        finally:
+            connection.release()
+    return probe
+
+
+class HealthMonitor(object):
+    """
+        This is the class that runs the dependency probes in the background
+        and keeps their latest results.
+    """
+    def __init__(self, interval=5.0, stale_after=30.0):
+        """
+            Constructor Function.
+
+            @:parameter
+                interval    -   Seconds between two rounds of probes.
+                stale_after -   Seconds after which a result that wasn't
+                                refreshed counts as a failure. This catches
+                                a probe that hangs.
+        """
+        self.interval = interval
+        self.stale_after = stale_after
+        self.probes = list()
+        self.results = dict()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.started_at = time.time()
+        self.thread = None
+
+    def add_probe(self, name, probe, critical=True):
+        """
+            Register a probe.
+
+            @:parameter
+                name        -   Name of the dependency. Ex: redis
+                probe       -   Callable that raises if the dependency is
+                                unavailable.
+                critical    -   The application isn't ready while a
+                                critical dependency is down.
+        """
+        self.probes.append((name, probe, critical))
+
+    def start(self):
+        """
+            Start probing in a background thread. The first round runs
+            right away.
+        """
+        self.thread = threading.Thread(target=self.__run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def __run(self):
+        while not self.stopped.is_set():
+            self.run_probes()
+            self.stopped.wait(self.interval)
+
+    def run_probes(self):
+        """
+            Run every probe once and cache the results. Each result replaces
+            the previous one as a whole, so readers never see a half updated
+            result.
+        """
+        for name, probe, critical in self.probes:
+            started = default_timer()
+            try:
+                probe()
+                (status, error) = (UP, None)
+            except Exception as exception:
+                (status, error) = (DOWN, str(exception) or
+                                   exception.__class__.__name__)
+            result = {
+                "status": status,
+                "latency": default_timer() - started,
+                "checked_at": time.time(),
+                "critical": critical,
+                "error": error
+            }
+            with self.lock:
+                self.results[name] = result
+
+    def get_health(self):
+        """
+            Obtain the cached results of the probes.
+
+            @:return
+                ready   -   True if every critical dependency is up and its
+                            result is recent.
+                checks  -   Dictionary of the dependency names to their
+                            status, latency in seconds, age in seconds and
+                            error.
+        """
+        now = time.time()
+        with self.lock:
+            results = dict(self.results)
+        ready = True
+        checks = dict()
+        for name, probe, critical in self.probes:
+            result = results.get(name)
+            if result is None:
+                checks[name] = {"status": "unknown", "critical": critical}
+                ready = ready and not critical
+                continue
+            check = dict(result)
+            check["age"] = now - result["checked_at"]
+            if check["age"] > self.stale_after:
+                check["status"] = "stale"
+            if critical and check["status"] != UP:
+                ready = False
+            checks[name] = check
+        return ready, checks
+
+    def get_uptime(self):
+        return time.time() - self.started_at
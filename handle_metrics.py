@@ -0,0 +1,349 @@
+#!/usr/bin/python
+"""
+    This file takes care of collecting the request, REDIS, PostgreSQL and
+    RPC timings of the application and exporting them in the Prometheus
+    text format.
+
+    Recording a value is meant to be cheap enough for the hot path. Every
+    thread writes into a shard of its own, so no lock is taken while
+    recording, and the histogram buckets of a series are allocated once
+    when the series is first seen. The shards are only summed up when the
+    metrics are scraped. The shard of a thread that exits is merged into a
+    base total, so threads started per request don't pile up shards. Each
+    process keeps metrics of its own.
+"""
+import bisect
+import functools
+import threading
+import weakref
+from timeit import default_timer
+
+try:
+    # under eventlet every green thread would get a shard of its own. The
+    # green threads of an OS thread never interleave while recording, so
+    # they can share the shard of the OS thread.
+    from eventlet.patcher import original
+    local = original("threading").local
+except ImportError:
+    local = threading.local
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def escape(value):
+    """
+        Escape a label value for the text format.
+    """
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n") \
+        .replace('"', '\\"')
+
+
+def format_labels(names, values, extra=""):
+    """
+        Render a set of label names and values. Ex: {method="get"}
+    """
+    pairs = ['%s="%s"' % (name, escape(value))
+             for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    if len(pairs) == 0:
+        return ""
+    return "{" + ",".join(pairs) + "}"
+
+
+def merge(totals, values):
+    """
+        Add the cells of a shard into a dictionary of totals.
+    """
+    for labels, cell in list(values.items()):
+        total = totals.get(labels)
+        if total is None:
+            totals[labels] = list(cell)
+        else:
+            for index, value in enumerate(cell):
+                total[index] += value
+
+
+class ShardOwner(object):
+    """
+        Kept in the thread local next to the shard. It goes away with the
+        thread, which tells the metric to retire the shard.
+    """
+    pass
+
+
+def format_value(value):
+    """
+        Render a sample value for the text format.
+    """
+    if isinstance(value, float):
+        if value == float("inf"):
+            return "+Inf"
+        return repr(value)
+    return str(value)
+
+
+class Metric(object):
+    """
+        This is the base class of the metrics recorded by the application.
+        It keeps the per thread shards of the recorded values.
+    """
+    kind = "untyped"
+
+    def __init__(self, name, description, labels=()):
+        """
+            Constructor Function.
+
+            @:parameter
+                name        -   Metric name. Ex: redis_call_seconds
+                description -   Help text of the metric.
+                labels      -   Names of the labels of the metric.
+        """
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.local = local()
+        self.shards = dict()
+        self.owners = dict()
+        self.base = dict()
+        self.lock = threading.Lock()
+
+    def _shard(self):
+        """
+            Obtain the shard of the calling thread. The lock is only taken
+            the first time a thread records a value.
+        """
+        try:
+            return self.local.values
+        except AttributeError:
+            values = dict()
+            owner = ShardOwner()
+            key = id(values)
+            with self.lock:
+                self.shards[key] = values
+                self.owners[key] = weakref.ref(
+                    owner, lambda reference: self._retire(key))
+            self.local.values = values
+            self.local.owner = owner
+            return values
+
+    def _retire(self, key):
+        """
+            Merge the shard of a thread that exited into the base total.
+        """
+        with self.lock:
+            values = self.shards.pop(key, None)
+            self.owners.pop(key, None)
+            if values is not None:
+                merge(self.base, values)
+
+    def _collect(self):
+        """
+            Sum up the base total and the shards of the live threads.
+
+            @:return
+                values  -   Dictionary of label values to the summed cells.
+        """
+        totals = dict()
+        with self.lock:
+            merge(totals, self.base)
+            shards = list(self.shards.values())
+        for shard in shards:
+            merge(totals, shard)
+        return totals
+
+    def render(self):
+        """
+            Render the metric in the text format.
+        """
+        lines = ["# HELP %s %s" % (self.name, self.description),
+                 "# TYPE %s %s" % (self.name, self.kind)]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+    def _samples(self):
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """
+        Monotonically increasing count. Ex: number of failed calls.
+    """
+    kind = "counter"
+
+    def inc(self, labels=(), amount=1):
+        """
+            Increase the count of the series identified by labels.
+        """
+        shard = self._shard()
+        cell = shard.get(labels)
+        if cell is None:
+            cell = shard[labels] = [0]
+        cell[0] += amount
+
+    def _samples(self):
+        for labels, cell in sorted(self._collect().items()):
+            yield "%s%s %s" % (self.name,
+                               format_labels(self.labels, labels),
+                               format_value(cell[0]))
+
+
+class Histogram(Metric):
+    """
+        Distribution of observed values over a fixed set of buckets. Ex:
+        latency of the REDIS calls.
+    """
+    kind = "histogram"
+
+    def __init__(self, name, description, labels=(),
+                 buckets=DEFAULT_BUCKETS):
+        """
+            Constructor Function.
+
+            @:parameter
+                buckets -   Sorted upper bounds of the buckets. A +Inf
+                            bucket is always added.
+        """
+        super(Histogram, self).__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labels=()):
+        """
+            Record a value in the series identified by labels.
+        """
+        shard = self._shard()
+        cell = shard.get(labels)
+        if cell is None:
+            # one count per bucket, one for +Inf and the sum at the end
+            cell = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def time(self, labels=(), errors=None):
+        """
+            Decorator that observes the time taken by each call of the
+            decorated function.
+
+            @:parameter
+                labels  -   Label values of the series.
+                errors  -   Optional Counter increased when a call raises.
+        """
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                started = default_timer()
+                try:
+                    return function(*args, **kwargs)
+                except:
+                    if errors is not None:
+                        errors.inc(labels)
+                    raise
+                finally:
+                    self.observe(default_timer() - started, labels)
+            return wrapper
+        return decorator
+
+    def _samples(self):
+        bounds = [format_value(float(bound)) for bound in self.buckets]
+        bounds.append("+Inf")
+        for labels, cell in sorted(self._collect().items()):
+            cumulative = 0
+            for bound, count in zip(bounds, cell):
+                cumulative += count
+                yield "%s_bucket%s %d" % (
+                    self.name,
+                    format_labels(self.labels, labels, 'le="%s"' % bound),
+                    cumulative)
+            yield "%s_sum%s %s" % (self.name,
+                                   format_labels(self.labels, labels),
+                                   format_value(cell[-1]))
+            yield "%s_count%s %d" % (self.name,
+                                     format_labels(self.labels, labels),
+                                     cumulative)
+
+
+class Callback(Metric):
+    """
+        Metric whose values are read from a callable at scrape time. Ex:
+        utilization of a connection pool.
+    """
+    def __init__(self, name, description, callback, labels=(),
+                 kind="gauge"):
+        """
+            Constructor Function.
+
+            @:parameter
+                callback    -   Callable returning a Dictionary of label
+                                value tuples to numbers, or None if there's
+                                nothing to report.
+                kind        -   gauge or counter.
+        """
+        super(Callback, self).__init__(name, description, labels)
+        self.callback = callback
+        self.kind = kind
+
+    def _samples(self):
+        try:
+            values = self.callback()
+        except:
+            values = None
+        for labels, value in sorted((values or dict()).items()):
+            yield "%s%s %s" % (self.name,
+                               format_labels(self.labels, labels),
+                               format_value(value))
+
+
+class MetricsRegistry(object):
+    """
+        This is the class that keeps the metrics of the process and renders
+        them for the /metrics endpoint.
+    """
+    def __init__(self):
+        self.metrics = list()
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, description, labels=()):
+        return self.register(Counter(name, description, labels))
+
+    def histogram(self, name, description, labels=(),
+                  buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, description, labels, buckets))
+
+    def callback(self, name, description, callback, labels=(),
+                 kind="gauge"):
+        return self.register(
+            Callback(name, description, callback, labels, kind))
+
+    def render(self):
+        """
+            Render all the metrics in the Prometheus text format.
+        """
+        with self.lock:
+            metrics = list(self.metrics)
+        return "\n".join([metric.render() for metric in metrics]) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+REDIS_CALLS = REGISTRY.histogram(
+    "redis_call_seconds", "Time taken by the REDIS calls.", ("method",))
+REDIS_ERRORS = REGISTRY.counter(
+    "redis_call_errors_total", "REDIS calls that failed.", ("method",))
+POSTGRES_CALLS = REGISTRY.histogram(
+    "postgres_call_seconds", "Time taken by the PostgreSQL calls.",
+    ("method",))
+POSTGRES_ERRORS = REGISTRY.counter(
+    "postgres_call_errors_total", "PostgreSQL calls that failed.",
+    ("method",))
+RPC_CALLS = REGISTRY.histogram(
+    "rpc_call_seconds", "Time taken by the nameko RPC calls.", ("method",))
+RPC_ERRORS = REGISTRY.counter(
+    "rpc_call_errors_total", "nameko RPC calls that raised.", ("method",))
+RPC_POOL_WAIT = REGISTRY.histogram(
+    "rpc_pool_wait_seconds", "Time spent waiting for a free RPC proxy.")
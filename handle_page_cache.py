@@ -0,0 +1,159 @@
+#!/usr/bin/python
+"""
+    This file takes care of caching the pages that only render a template.
+
+    The rendered body of such a page is kept in memory along with an ETag
+    and a Last-Modified date, so later requests skip the render and the
+    browsers that already hold the page get a 304 instead of the body.
+
+    The static files are linked with a fingerprint of their content in the
+    URL, so they can be cached by the browsers for a long time and are
+    fetched again as soon as they change.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import request, make_response, Response
+
+
+class PageCache(object):
+    """
+        This is the class that keeps the rendered bodies of the cached
+        routes, keyed by the path and the query arguments.
+    """
+    def __init__(self, enabled=True, max_entries=256, max_age=300):
+        """
+            Constructor Function.
+
+            @:parameter
+                enabled     -   Setting this to False renders every time.
+                max_entries -   Maximum number of bodies kept.
+                max_age     -   Seconds a body is kept and may be cached by
+                                the browsers.
+        """
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __get(self, key):
+        # counts the hit or miss along with the look-up, under the lock
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry["expires"] <= time.time():
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.pop(key)
+            self.entries[key] = entry
+            self.hits += 1
+            return entry
+
+    def __put(self, key, entry):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = entry
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def cached(self, view):
+        """
+            Decorator for a route whose response only depends on its path
+            and query arguments. Only GET and HEAD requests with a 200
+            response are cached.
+        """
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not self.enabled or request.method not in ("GET", "HEAD"):
+                return view(*args, **kwargs)
+            key = request.path + "?" + "&".join(
+                ["%s=%s" % pair
+                 for pair in sorted(request.args.items(multi=True))])
+            entry = self.__get(key)
+            if entry is None:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200 or response.is_streamed:
+                    return response
+                body = response.get_data()
+                entry = {
+                    "body": body,
+                    "content_type": response.headers.get("Content-Type"),
+                    "etag": hashlib.sha1(body).hexdigest(),
+                    "last_modified": int(time.time()),
+                    "expires": time.time() + self.max_age
+                }
+                self.__put(key, entry)
+
+            response = Response(entry["body"],
+                                content_type=entry["content_type"])
+            response.set_etag(entry["etag"])
+            response.last_modified = entry["last_modified"]
+            response.cache_control.public = True
+            response.cache_control.max_age = self.max_age
+            return response.make_conditional(request)
+        return wrapper
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self.entries)
+            }
+
+
+class StaticFingerprints(object):
+    """
+        This is the class that works out the fingerprints of the static
+        files. A fingerprint is only computed again once the modification
+        time of the file changes.
+    """
+    def __init__(self, static_folder):
+        """
+            Constructor Function.
+
+            @:parameter
+                static_folder   -   Folder holding the static files.
+        """
+        self.static_folder = static_folder
+        self.fingerprints = dict()
+        self.lock = threading.Lock()
+
+    def get(self, filename):
+        """
+            Obtain the fingerprint of a static file.
+
+            @:return
+                fingerprint -   Hex digest of the content, or None if the
+                                file doesn't exist.
+        """
+        path = os.path.join(self.static_folder, filename)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+        with self.lock:
+            cached = self.fingerprints.get(filename)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        digest = hashlib.md5()
+        with open(path, "rb") as static_file:
+            for chunk in iter(lambda: static_file.read(65536), b""):
+                digest.update(chunk)
+        fingerprint = digest.hexdigest()[:12]
+        with self.lock:
+            self.fingerprints[filename] = (mtime, fingerprint)
+        return fingerprint
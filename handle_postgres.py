@@ -3,11 +3,23 @@
     This is the base file that takes care of the process of handling a
     connection with postgresql. User can create an object of this class
     and user this as an interface to interact with Postgres easily.
+
+    The handler can run in two modes. The default mode shares a single
+    connection between all the callers. The pooled mode keeps a pool of
+    connections from which each request checks out one of its own.
 """
 
 # Library file required to setup Postgres.
 import psycopg2
+import psycopg2.extras
+import psycopg2.pool
+import threading
+import time
 import traceback
+import uuid
+from contextlib import contextmanager
+
+from handle_metrics import POSTGRES_CALLS, POSTGRES_ERRORS
 
 
 class PostgreSQL(object):
@@ -16,7 +28,9 @@ class PostgreSQL(object):
         to the end user with ease of access and handling.
     """
     def __init__(self, database="test", user="postgres",
-                 password="password", host="127.0.0.1", port=4532):
+                 password="password", host="127.0.0.1", port=4532,
+                 pool_min=0, pool_max=0, idle_check=30, retries=3,
+                 backoff=0.5):
         """
             This is the object Constructor function that processes the
             incoming items and creates a connection with Postgres.
@@ -27,39 +41,214 @@ class PostgreSQL(object):
                 password    -   Postgres User password
                 host        -   Postgres host name
                 part        -   Connection port for Postgres
+                pool_min    -   Connections opened upfront in pooled mode
+                pool_max    -   Maximum pooled connections. 0 disables the
+                                pooled mode.
+                idle_check  -   Seconds after which an idle connection is
+                                health-checked before being handed out.
+                retries     -   Reconnect attempts before giving up.
+                backoff     -   Base delay between reconnect attempts.
         """
         self.database = database
         self.user = user
         self.password = password
         self.host = host
         self.port = port
+        self.pool_min = pool_min
+        self.pool_max = pool_max
+        self.idle_check = idle_check
+        self.retries = retries
+        self.backoff = backoff
         self.error_found = False
         self.error = None
         self.postgres = None
         self.cursor = None
+        self.pool = None
+        self.pool_slots = None
+        self.last_used = dict()
+        self.lock = threading.RLock()
+        self.in_use = 0
         self.connected = False
         self.__initialize()
 
+    def is_pooled(self):
+        """
+            Check if the handler runs with a Connection Pool.
+        """
+        return self.pool_max > 0
+
+    def __connect_args(self):
+        """
+            Connection arguments shared by the single connection and the
+            connections opened by the Pool.
+        """
+        return {
+            "database": self.database,
+            "user": self.user,
+            "password": self.password,
+            "host": self.host,
+            "port": self.port
+        }
+
     def __initialize(self):
         """
             This function is used as an initializer that actually sets-up a
             connection to the Postgres machine and creates a Cursor Object.
+            In the pooled mode this creates the Connection Pool instead.
         """
         try:
-            self.postgres = psycopg2.connect(
-                database=self.database,
-                user=self.user,
-                password=self.password,
-                host=self.host,
-            )
-            self.connected = True
-            self.cursor = self.postgres.cursor()
-            self.__setup_demo_database()
+            if self.is_pooled():
+                self.pool = self.__retry(
+                    lambda: psycopg2.pool.ThreadedConnectionPool(
+                        self.pool_min,
+                        self.pool_max,
+                        **self.__connect_args()))
+                self.pool_slots = threading.BoundedSemaphore(self.pool_max)
+                self.connected = True
+                with self.connection() as connection:
+                    self.__setup_demo_database(connection)
+            else:
+                self.postgres = psycopg2.connect(**self.__connect_args())
+                self.connected = True
+                self.cursor = self.postgres.cursor()
+                self.__setup_demo_database(self.postgres)
         except:
+            self.connected = False
             self.error_found = True
             self.error = "Failed to Create a Connection with Postgres."
 
-    def __setup_demo_database(self):
+    def __reconnect(self, broken=None):
+        """
+            Replace the shared connection after a failure. This holds the
+            lock, so no other thread is using the connection meanwhile, and
+            closes the old connection so that it isn't leaked.
+
+            @:parameter
+                broken  -   Connection that failed. Nothing is done if
+                            another thread has replaced it already.
+        """
+        with self.lock:
+            if broken is not None and broken is not self.postgres:
+                return
+            if self.postgres is not None:
+                try:
+                    self.postgres.close()
+                except:
+                    pass
+                self.postgres = None
+                self.cursor = None
+            self.__initialize()
+
+    def __retry(self, connect):
+        """
+            Invoke the connect callable and retry with an exponential
+            backoff if Postgres is unreachable.
+
+            @:parameter
+                connect     -   Callable that opens the connection(s).
+        """
+        attempt = 0
+        while True:
+            try:
+                return connect()
+            except psycopg2.OperationalError:
+                if attempt >= self.retries:
+                    raise
+                time.sleep(self.backoff * (2 ** attempt))
+                attempt += 1
+
+    def __is_healthy(self, connection):
+        """
+            Validate a pooled connection before handing it out. Connections
+            that were idle for less than idle_check seconds are trusted.
+        """
+        if connection.closed:
+            return False
+        last_used = self.last_used.get(id(connection))
+        if last_used is None or time.time() - last_used < self.idle_check:
+            return True
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def __checkout(self):
+        """
+            Obtain a healthy connection from the Pool. Broken connections
+            are discarded and replaced by fresh ones.
+        """
+        while True:
+            connection = self.__retry(self.pool.getconn)
+            if self.__is_healthy(connection):
+                return connection
+            self.last_used.pop(id(connection), None)
+            self.pool.putconn(connection, close=True)
+
+    @contextmanager
+    def connection(self):
+        """
+            Context Manager that hands out a connection for the duration of
+            a request. In the pooled mode the connection is checked out of
+            the Pool and returned to it once done. Otherwise the shared
+            connection is handed out while holding a lock so that two
+            threads never use it at the same time.
+        """
+        if not self.is_pooled():
+            with self.lock:
+                yield self.postgres
+            return
+
+        self.pool_slots.acquire()
+        connection = None
+        broken = False
+        with self.lock:
+            self.in_use += 1
+        try:
+            connection = self.__checkout()
+            yield connection
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        except:
+            try:
+                connection.rollback()
+            except:
+                broken = True
+            raise
+        finally:
+            if connection is not None:
+                broken = broken or bool(connection.closed)
+                if broken:
+                    self.last_used.pop(id(connection), None)
+                else:
+                    self.last_used[id(connection)] = time.time()
+                self.pool.putconn(connection, close=broken)
+            with self.lock:
+                self.in_use -= 1
+            self.pool_slots.release()
+
+    def get_pool_stats(self):
+        """
+            Obtain the pool utilization figures.
+
+            @:return
+                stats   -   Dictionary with the size of the Pool and the
+                            connections checked out. None in the single
+                            connection mode.
+        """
+        if not self.is_pooled():
+            return None
+        with self.lock:
+            return {
+                "size": self.pool_max,
+                "in_use": self.in_use
+            }
+
+    def __setup_demo_database(self, connection):
         """
             This function acts as a way to setup a Demo Database Table if one
             doesn't exist. This is a safety net that prevents the user from
@@ -71,53 +260,195 @@ class PostgreSQL(object):
              EMAIL      TEXT                NOT NULL);
         '''
         try:
-            self.cursor.execute(create_string)
-            self.postgres.commit()
+            cursor = connection.cursor()
+            cursor.execute(create_string)
+            connection.commit()
         except:
             self.error_found = True
             self.error = "Failed to Setup Demo Database Table. " + \
-                         traceback.print_exc()
+                         traceback.format_exc()
 
+    @POSTGRES_CALLS.time(("run_query_store",))
     def run_query_store(self, query_string, binding=None):
         """
             This function acts as a way to run a Query on the Postgres machine
             and this function is used for Persisting the Data to PostgreSQL
             system from the UI.
         """
+        connection = None
         try:
-            if self.connected and self.cursor is not None:
-                if binding is not None:
-                    self.cursor.execute(query_string, binding)
-                else:
-                    self.cursor.execute(query_string)
-                self.postgres.commit()
+            if self.connected:
+                with self.connection() as connection:
+                    cursor = connection.cursor()
+                    if binding is not None:
+                        cursor.execute(query_string, binding)
+                    else:
+                        cursor.execute(query_string)
+                    connection.commit()
+                    cursor.close()
                 return ""
             else:
                 return None
         except:
-            self.__initialize()
+            POSTGRES_ERRORS.inc(("run_query_store",))
             self.error_found = True
-            self.error = "Failed to Execute the Query." + traceback.print_exc()
+            self.error = "Failed to Execute the Query." + \
+                traceback.format_exc()
+            if not self.is_pooled():
+                self.__reconnect(connection)
             return self.error
 
-    def run_query(self, quert_string):
+    @POSTGRES_CALLS.time(("run_query_store_many",))
+    def run_query_store_many(self, query_string, bindings,
+                             synchronous_commit=True):
+        """
+            This function persists a batch of rows using a single multi-row
+            INSERT and a single commit. The query_string must contain one
+            %s placeholder for the VALUES list.
+
+            @:parameter
+                query_string        -   Ex: INSERT INTO DEMO (USERNAME,
+                                        EMAIL) VALUES %s
+                bindings            -   List of tuples to Insert.
+                synchronous_commit  -   Setting this to False lets the
+                                        commit return before the WAL is
+                                        flushed to disk.
+        """
+        connection = None
+        try:
+            if self.connected:
+                with self.connection() as connection:
+                    cursor = connection.cursor()
+                    if not synchronous_commit:
+                        cursor.execute("SET LOCAL synchronous_commit TO OFF")
+                    psycopg2.extras.execute_values(
+                        cursor,
+                        query_string,
+                        bindings,
+                        page_size=max(len(bindings), 1))
+                    connection.commit()
+                    cursor.close()
+                return ""
+            else:
+                return None
+        except:
+            POSTGRES_ERRORS.inc(("run_query_store_many",))
+            self.error_found = True
+            self.error = "Failed to Execute the Batch Query." + \
+                traceback.format_exc()
+            if not self.is_pooled():
+                self.__reconnect(connection)
+            return self.error
+
+    @POSTGRES_CALLS.time(("run_query",))
+    def run_query(self, quert_string, binding=None):
         """
             This function acts as a wat to read the Data from PostgreSQL
             machine.
 
+            @:parameter
+                quert_string    -   Query to Run.
+                binding         -   Optional values for the placeholders.
+
             @:return
                 postgres_data   -   JSON data of all items in PostgreSQL.
         """
         try:
-            if self.connected and self.cursor is not None:
-                self.cursor.execute(quert_string)
-                rows = self.cursor.fetchall()
+            if self.connected:
+                with self.connection() as connection:
+                    cursor = connection.cursor()
+                    if binding is not None:
+                        cursor.execute(quert_string, binding)
+                    else:
+                        cursor.execute(quert_string)
+                    rows = cursor.fetchall()
+                    cursor.close()
+                    if self.is_pooled():
+                        connection.rollback()
                 return rows
             else:
                 return "", "ERROR", "Failed to Obtain Data from PostgreSQL."
         except:
+            POSTGRES_ERRORS.inc(("run_query",))
             return "", "", ""
 
+    def iter_query(self, query_string, binding=None, chunk_size=1000):
+        """
+            This function streams the result of a Query using a named, server
+            side cursor. Rows are pulled from Postgres chunk_size at a time,
+            so the full result is never held in memory.
+
+            The connection stays checked out until the iteration completes
+            or the generator is closed. In the single connection mode this
+            blocks all the other callers for that duration.
+
+            @:parameter
+                query_string    -   Query to Run.
+                binding         -   Optional values for the placeholders.
+                chunk_size      -   Rows fetched per round-trip.
+
+            @:return
+                rows            -   List of at most chunk_size rows. A
+                                    psycopg2.Error raised midway is
+                                    recorded and raised again, so the
+                                    caller can tell the rows are partial.
+        """
+        if not self.connected:
+            return
+        try:
+            with self.connection() as connection:
+                cursor = connection.cursor(name="stream_" + uuid.uuid4().hex)
+                cursor.itersize = chunk_size
+                try:
+                    if binding is not None:
+                        cursor.execute(query_string, binding)
+                    else:
+                        cursor.execute(query_string)
+                    while True:
+                        rows = cursor.fetchmany(chunk_size)
+                        if len(rows) == 0:
+                            break
+                        yield rows
+                finally:
+                    if not connection.closed:
+                        cursor.close()
+                        connection.rollback()
+        except psycopg2.Error:
+            POSTGRES_ERRORS.inc(("iter_query",))
+            self.error_found = True
+            self.error = "Failed to Stream the Query." + \
+                traceback.format_exc()
+            raise
+
+    def ping(self):
+        """
+            This function checks that PostgreSQL answers by running SELECT 1
+            on a connection. A handler that isn't connected tries to connect
+            first.
+
+            @:return
+                Raises an Exception if PostgreSQL can't be reached.
+        """
+        if not self.connected:
+            self.__reconnect()
+            if not self.connected:
+                raise psycopg2.OperationalError(
+                    self.error or "Not connected to PostgreSQL.")
+        connection = None
+        try:
+            with self.connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("SELECT 1")
+                cursor.fetchone()
+                cursor.close()
+                connection.rollback()
+        except Exception as exception:
+            # a broken shared connection is replaced for the next caller.
+            # Broken pooled connections are discarded by the Pool itself.
+            if not self.is_pooled():
+                self.__reconnect(connection)
+            raise exception
+
     def check_status(self):
         """
             This function acts as a way to check and monitor the connection
@@ -130,3 +461,13 @@ class PostgreSQL(object):
             if error is None:
                 error = "Unable to Identify PostgreSQL connection Status."
             return False, error
+
+    def close(self):
+        """
+            Close the shared connection or all the connections in the Pool.
+        """
+        self.connected = False
+        if self.pool is not None:
+            self.pool.closeall()
+        if self.postgres is not None:
+            self.postgres.close()
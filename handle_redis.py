@@ -5,9 +5,51 @@
     handled in this file.
 
     An object of this can be created and used as per the user convenience.
+
+    Connections come from a pool with socket timeouts. Calls that fail to
+    reach REDIS are retried with a jittered backoff, and once REDIS looks
+    down a circuit breaker makes the calls fail fast until a trial call
+    gets through. The error of a call is only visible to the thread that
+    made it and is cleared by the next call of that thread.
 """
+import atexit
 import redis
-import json
+import random
+import threading
+import time
+
+from handle_breaker import CircuitBreaker, CircuitOpenError
+from handle_encoding import dumps
+from handle_metrics import REDIS_CALLS, REDIS_ERRORS
+
+# moves up to ARGV[1] items from the head of KEYS[1] to the tail of KEYS[2]
+# and returns everything KEYS[2] holds
+MOVE_LIST_SCRIPT = """
+local values = redis.call("LRANGE", KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #values > 0 then
+    redis.call("LTRIM", KEYS[1], #values, -1)
+    for index = 1, #values do
+        redis.call("RPUSH", KEYS[2], values[index])
+    end
+end
+return redis.call("LRANGE", KEYS[2], 0, -1)
+"""
+
+# deletes KEYS[1] and pushes either all of its items (ARGV[1] is "all") or
+# ARGV[2..] back to the head of KEYS[2] in their order
+RESTORE_LIST_SCRIPT = """
+local values = ARGV
+local first = 2
+if ARGV[1] == "all" then
+    values = redis.call("LRANGE", KEYS[1], 0, -1)
+    first = 1
+end
+redis.call("DEL", KEYS[1])
+for index = #values, first, -1 do
+    redis.call("LPUSH", KEYS[2], values[index])
+end
+return #values - first + 1
+"""
 
 
 class RedisHandler(object):
@@ -19,37 +61,75 @@ class RedisHandler(object):
         of and handle the Redis Changes. The contents of this file,
         for this demo application is very primitive and can be extended.
     """
-    def __init__(self, host="localhost", port=6379, password=""):
+    def __init__(self, host="localhost", port=6379, password="",
+                 max_connections=50, socket_timeout=1.0,
+                 connect_timeout=1.0, retries=2, backoff=0.05,
+                 failure_threshold=5, reset_timeout=5.0):
         """
             Constructor Function.
 
             @:parameter
-                host        -   Redis Host
-                port        -   Redis Connection Port
-                password    -   Redis Connection Password
+                host                -   Redis Host
+                port                -   Redis Connection Port
+                password            -   Redis Connection Password
+                max_connections     -   Connections kept in the pool.
+                socket_timeout      -   Seconds to wait for a reply.
+                connect_timeout     -   Seconds to wait for a connection.
+                retries             -   Attempts after a connection
+                                        failure before a call fails.
+                backoff             -   Base delay between attempts.
+                failure_threshold   -   Failed calls in a row that open
+                                        the circuit.
+                reset_timeout       -   Seconds the circuit stays open.
         """
         self.host = host
         self.port = port
         self.password = password
+        self.max_connections = max_connections
+        self.socket_timeout = socket_timeout
+        self.connect_timeout = connect_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.state = threading.local()
         self.redis = None
-        self.error_found = False
-        self.__initialize()
         self.info = None
-        self.error = ""
+        self.__initialize()
+
+    @property
+    def error_found(self):
+        return getattr(self.state, "error_found", False)
+
+    @error_found.setter
+    def error_found(self, value):
+        self.state.error_found = value
+
+    @property
+    def error(self):
+        return getattr(self.state, "error", "")
+
+    @error.setter
+    def error(self, value):
+        self.state.error = value
 
     def __initialize(self):
         """
             This is the base initializer function that is invoked from
             the __init__ function. This sets-up all your REDIS required
-            constraints.
+            constraints. Connections are opened lazily by the pool, so a
+            REDIS that is down at this point is picked up once it's back.
         """
+        pool = redis.ConnectionPool(
+            host=self.host,
+            port=self.port,
+            password=self.password,
+            max_connections=self.max_connections,
+            socket_timeout=self.socket_timeout,
+            socket_connect_timeout=self.connect_timeout)
+        self.redis = redis.StrictRedis(connection_pool=pool)
         try:
-            self.redis = redis.StrictRedis(
-                host=self.host,
-                port=self.port,
-                password=self.password)
-            self.info = self.redis.info()
-        except redis.ConnectionError:
+            self.info = self.__execute(self.redis.info)
+        except (redis.ConnectionError, redis.TimeoutError, CircuitOpenError):
             """
                 For the purpose of this function, lets set a variable saying
                 we faced an error setting up REDIS.
@@ -57,7 +137,93 @@ class RedisHandler(object):
             self.error = "Connection Error trying to Access REDIS."
             self.error_found = True
 
-    def add_to_redis(self, key, value=None):
+    def __execute(self, call):
+        """
+            Run a call against REDIS through the circuit breaker. The error
+            of the previous call of this thread is cleared first.
+
+            Calls that can't reach REDIS are retried up to retries times
+            with a random delay of up to backoff * 2 ^ attempt seconds. Any
+            other error means REDIS answered and is raised right away.
+
+            @:parameter
+                call    -   Callable doing the REDIS round-trip(s). It is
+                            invoked again on a retry, so pipelines must be
+                            built inside of it.
+
+            @:return
+                result  -   Return value of the call.
+        """
+        self.reset_error()
+        if not self.breaker.allow():
+            raise CircuitOpenError("REDIS is unavailable. Failing fast.")
+        attempt = 0
+        while True:
+            try:
+                result = call()
+            except (redis.ConnectionError, redis.TimeoutError):
+                if attempt >= self.retries or self.breaker.is_open():
+                    self.breaker.record_failure()
+                    raise
+                attempt += 1
+                time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+                continue
+            except:
+                self.breaker.record_success()
+                raise
+            self.breaker.record_success()
+            return result
+
+    def __pipeline(self, build, transaction=False):
+        """
+            Run a pipeline through __execute. The pipeline is built again on
+            every attempt since a failed pipeline drops its commands.
+
+            @:parameter
+                build       -   Callable that queues the commands on the
+                                pipeline handed to it.
+                transaction -   Wrap the commands in MULTI/EXEC.
+
+            @:return
+                results     -   List of the results of the commands.
+        """
+        def call():
+            pipeline = self.redis.pipeline(transaction=transaction)
+            build(pipeline)
+            return pipeline.execute()
+        return self.__execute(call)
+
+    def run_pipeline(self, build, transaction=True):
+        """
+            This function runs a set of commands in a single round-trip,
+            wrapped in MULTI/EXEC by default so that they all apply or none
+            of them do.
+
+            @:parameter
+                build       -   Callable that queues the commands on the
+                                pipeline handed to it.
+                transaction -   Wrap the commands in MULTI/EXEC.
+
+            @:return
+                results     -   List of the results of the commands, or None
+                                if REDIS couldn't be reached.
+        """
+        try:
+            return self.__pipeline(build, transaction=transaction)
+        except:
+            self.error_found = True
+            self.error = "Failed to Run the Pipeline."
+            return None
+
+    def is_available(self):
+        """
+            Check if calls are let through to REDIS. This is False while the
+            circuit breaker fails the calls fast.
+        """
+        return not self.breaker.is_open()
+
+    @REDIS_CALLS.time(("add_to_redis",))
+    def add_to_redis(self, key, value=None, expire=None):
         """
             This function acts as an interface that the user can make use of
             for creating an item in the REDIS Cache for Processing/any other
@@ -66,13 +232,75 @@ class RedisHandler(object):
             @:parameter
                 key     -   Key to use for Setting Redis Item.
                 value   -   Value to be set for the key.
+                expire  -   Optional expiry for the key in seconds.
+        """
+        try:
+            self.__execute(lambda: self.redis.set(key, value, ex=expire))
+        except:
+            REDIS_ERRORS.inc(("add_to_redis",))
+            self.error_found = True
+            self.error = "Failed to Set Value %s to Key %s" % (value, key)
+
+    @REDIS_CALLS.time(("add_many_to_redis",))
+    def add_many_to_redis(self, items, expire=None):
+        """
+            This function creates a set of items in the REDIS Cache using a
+            single round-trip.
+
+            @:parameter
+                items   -   Dictionary of Keys and the Values to set.
+                expire  -   Optional expiry for the keys in seconds.
+        """
+        try:
+            if len(items) == 0:
+                return
+            if expire is None:
+                self.__execute(lambda: self.redis.mset(items))
+            else:
+                def build(pipeline):
+                    for key, value in items.items():
+                        pipeline.set(key, value, ex=expire)
+                self.__pipeline(build)
+        except:
+            REDIS_ERRORS.inc(("add_many_to_redis",))
+            self.error_found = True
+            self.error = "Failed to Set Values for Keys " + \
+                ", ".join([str(key) for key in items])
+
+    @REDIS_CALLS.time(("get_many_from_redis",))
+    def get_many_from_redis(self, keys):
+        """
+            This function obtains the values for a list of keys from the
+            REDIS cache using a single MGET.
+
+            @:parameter
+                keys    -   List of Keys to Read.
+
+            @:return
+                values  -   List of Values in the order of the keys. Keys
+                            that don't exist get a None.
         """
         try:
-            self.redis.set(key, value)
+            return self.__execute(lambda: self.redis.mget(keys))
         except:
+            REDIS_ERRORS.inc(("get_many_from_redis",))
             self.error_found = True
-            self.error = "Failed to Set Value " + value + " to Key " + key
+            self.error = "Failed to get values for Keys " + \
+                ", ".join([str(key) for key in keys])
+            return [None] * len(keys)
 
+    def delete_from_redis(self, *keys):
+        """
+            This function removes a set of keys from the REDIS cache.
+        """
+        try:
+            self.__execute(lambda: self.redis.delete(*keys))
+        except:
+            self.error_found = True
+            self.error = "Failed to Delete Keys " + \
+                ", ".join([str(key) for key in keys])
+
+    @REDIS_CALLS.time(("get_from_redis",))
     def get_from_redis(self, key, auth=False):
         """
             This function acts as an interface while the user tries to obtain
@@ -94,10 +322,11 @@ class RedisHandler(object):
                 else:
                     return ""
             else:
-                return self.redis.get(key)
+                return self.__execute(lambda: self.redis.get(key))
         except:
+            REDIS_ERRORS.inc(("get_from_redis",))
             self.error_found = True
-            self.error = "Failed to get value for Key " + key
+            self.error = "Failed to get value for Key %s" % (key, )
             if auth:
                 return False
             else:
@@ -113,11 +342,221 @@ class RedisHandler(object):
                 value   -   Value to Append to the Redis List.
         """
         try:
-            self.redis.rpush(key, value)
+            self.__execute(lambda: self.redis.rpush(key, value))
         except:
             self.error_found = True
-            self.error = "Failed to Append Value " + value + \
-                         " to list with Key " + key
+            self.error = "Failed to Append Value %s to list with Key %s" % \
+                (value, key)
+
+    def add_many_to_redis_list(self, key, values):
+        """
+            This function appends a list of items to an array in REDIS using
+            a single RPUSH.
+
+            @:parameter
+                key     -   Key to use for Setting Redis Item.
+                values  -   Values to Append to the Redis List.
+        """
+        try:
+            if len(values) > 0:
+                self.__execute(lambda: self.redis.rpush(key, *values))
+        except:
+            self.error_found = True
+            self.error = "Failed to Append Values to list with Key %s" % \
+                (key, )
+
+    def add_to_capped_redis_list(self, key, value, max_length):
+        """
+            This function appends an item to an array in REDIS and drops
+            the oldest items beyond max_length, in a single round-trip.
+
+            @:parameter
+                key         -   Key of the Redis List.
+                value       -   Value to Append to the Redis List.
+                max_length  -   Number of Items kept.
+        """
+        try:
+            def build(pipeline):
+                pipeline.rpush(key, value)
+                pipeline.ltrim(key, -max_length, -1)
+            self.__pipeline(build, transaction=True)
+        except:
+            self.error_found = True
+            self.error = "Failed to Append Value to list with Key %s" % (key, )
+
+    def get_redis_list(self, key):
+        """
+            This function returns all the items of an array in REDIS.
+
+            @:parameter
+                key     -   Key of the Redis List.
+
+            @:return
+                values  -   List of Items in the Redis List.
+        """
+        try:
+            return self.__execute(lambda: self.redis.lrange(key, 0, -1))
+        except:
+            self.error_found = True
+            self.error = "Failed to Read list with Key %s" % (key, )
+            return list()
+
+    def pop_from_redis_list(self, key, count=1):
+        """
+            This function atomically removes and returns up to count items
+            from the head of a REDIS list.
+
+            @:parameter
+                key     -   Key of the Redis List.
+                count   -   Maximum number of Items to Pop.
+
+            @:return
+                values  -   List of Items Removed from the Redis List.
+        """
+        try:
+            def build(pipeline):
+                pipeline.lrange(key, 0, count - 1)
+                pipeline.ltrim(key, count, -1)
+            values, _ = self.__pipeline(build, transaction=True)
+            return values
+        except:
+            self.error_found = True
+            self.error = "Failed to Pop Values from list with Key %s" % (key, )
+            return list()
+
+    def return_to_redis_list(self, key, values):
+        """
+            This function pushes items back to the head of a REDIS list in
+            their original order. Used to hand back items that were popped
+            but couldn't be processed.
+
+            @:parameter
+                key     -   Key of the Redis List.
+                values  -   List of Items to Push back.
+        """
+        try:
+            if len(values) > 0:
+                self.__execute(
+                    lambda: self.redis.lpush(key, *reversed(values)))
+        except:
+            self.error_found = True
+            self.error = "Failed to Return Values to list with Key %s" % \
+                (key, )
+
+    def move_redis_list(self, source, destination, count=1):
+        """
+            This function atomically moves up to count items from the head
+            of a REDIS list to the tail of another one. Used to hold items
+            in a processing list until they are done with, so that a crash
+            in between doesn't lose them.
+
+            @:parameter
+                source      -   Key of the Redis List to take from.
+                destination -   Key of the Redis List to move into.
+                count       -   Maximum number of Items to Move.
+
+            @:return
+                values      -   All the Items in the destination list,
+                                including the ones left there earlier.
+        """
+        try:
+            return self.__execute(lambda: self.redis.eval(
+                MOVE_LIST_SCRIPT, 2, source, destination, count))
+        except:
+            self.error_found = True
+            self.error = "Failed to Move Values from list with Key %s" % \
+                (source, )
+            return list()
+
+    def restore_redis_list(self, source, destination, values=None):
+        """
+            This function atomically deletes a REDIS list and pushes items
+            back to the head of another one in their original order.
+
+            @:parameter
+                source      -   Key of the Redis List to delete.
+                destination -   Key of the Redis List to push back into.
+                values      -   Items to push back. All the items of the
+                                source list when None.
+        """
+        try:
+            if values is None:
+                arguments = ["all"]
+            else:
+                arguments = ["values"] + list(values)
+            self.__execute(lambda: self.redis.eval(
+                RESTORE_LIST_SCRIPT, 2, source, destination, *arguments))
+        except:
+            self.error_found = True
+            self.error = "Failed to Restore Values to list with Key %s" % \
+                (destination, )
+
+    def incr_counter(self, key, amount=1):
+        """
+            This function atomically increments a counter in REDIS.
+
+            @:parameter
+                key     -   Key of the Counter.
+                amount  -   Value to add to the Counter.
+
+            @:return
+                value   -   Value of the Counter after the increment. None
+                            if REDIS couldn't be reached.
+        """
+        try:
+            return self.__execute(lambda: self.redis.incrby(key, amount))
+        except:
+            self.error_found = True
+            self.error = "Failed to Increment Counter with Key %s" % (key, )
+            return None
+
+    def incr_sharded_counter(self, key, shard, amount=1):
+        """
+            This function increments one shard of a counter that is spread
+            across several keys, so that a hot counter isn't a single hot
+            key. The shard is registered in the key:shards set so that the
+            total can be read back with get_sharded_counter.
+
+            @:parameter
+                key     -   Key of the Counter.
+                shard   -   Name of the Shard. Ex: the node name.
+                amount  -   Value to add to the Shard.
+        """
+        try:
+            def build(pipeline):
+                pipeline.incrby(key + ":shard:" + shard, amount)
+                pipeline.sadd(key + ":shards", shard)
+            return self.__pipeline(build)[0]
+        except:
+            self.error_found = True
+            self.error = "Failed to Increment Counter with Key %s" % (key, )
+            return None
+
+    def get_sharded_counter(self, key):
+        """
+            This function reads the total of a sharded counter.
+
+            @:return
+                total   -   Sum of all the Shards. None if REDIS couldn't be
+                            reached.
+        """
+        try:
+            shards = sorted(self.__execute(
+                lambda: self.redis.smembers(key + ":shards")))
+            if len(shards) == 0:
+                return 0
+            keys = list()
+            for shard in shards:
+                if isinstance(shard, bytes):
+                    shard = shard.decode("utf-8")
+                keys.append(key + ":shard:" + shard)
+            values = self.__execute(lambda: self.redis.mget(keys))
+            return sum([int(value) for value in values
+                        if value is not None])
+        except:
+            self.error_found = True
+            self.error = "Failed to Read Counter with Key %s" % (key, )
+            return None
 
     def check_error(self):
         """
@@ -137,28 +576,147 @@ class RedisHandler(object):
             This returns a list of Lists with 2 values in each of the internal
             lists.
 
+            Prefer iter_keys or scan_page on large key spaces. This function
+            holds the whole key space in memory.
+
             @:return
                 redis_data  -   List of Redis Items stored.
         """
-        redis_data = list()
+        redis_data = list(self.iter_keys())
+        if self.error_found:
+            return ["Error", self.error]
+        return redis_data
+
+    def iter_keys(self, match=None, count=500):
+        """
+            This function iterates over the Redis key space using SCAN so
+            that the Redis server is never blocked the way KEYS does. The
+            values are fetched in pipelined batches of count keys.
+
+            @:parameter
+                match   -   Optional glob pattern to filter the keys.
+                count   -   COUNT hint passed to SCAN for each batch.
+
+            @:return
+                item    -   Dictionary with key, value and type.
+        """
+        cursor = 0
+        while True:
+            cursor, items = self.scan_page(cursor, match=match, count=count)
+            for item in items:
+                yield item
+            if cursor == 0:
+                break
+
+    def scan_keys(self, match=None, count=500):
+        """
+            This function iterates over the names of the keys in the Redis
+            key space using SCAN, without fetching any of the values.
+
+            @:parameter
+                match   -   Optional glob pattern to filter the keys.
+                count   -   COUNT hint passed to SCAN for each batch.
+
+            @:return
+                key     -   Name of a Key.
+        """
+        cursor = 0
+        while True:
+            try:
+                cursor, keys = self.__execute(lambda: self.redis.scan(
+                    cursor=cursor, match=match, count=count))
+            except:
+                self.error_found = True
+                self.error = "Failed to Scan the Redis Keys."
+                return
+            for key in keys:
+                yield key
+            if int(cursor) == 0:
+                break
+
+    def scan_page(self, cursor=0, match=None, count=500):
+        """
+            This function runs a single SCAN step and fetches the values for
+            the keys it returns. Callers can hand the returned cursor back in
+            to obtain the next page. A cursor of 0 marks the end.
+
+            @:parameter
+                cursor  -   SCAN cursor to continue from.
+                match   -   Optional glob pattern to filter the keys.
+                count   -   COUNT hint passed to SCAN.
+
+            @:return
+                cursor  -   Cursor for the next page.
+                items   -   List of dictionaries with key, value and type.
+        """
         try:
-            redis_keys = self.redis.keys()
-            for key in redis_keys:
-                value = self.redis.get(key)
-                if type(value) is list:
-                    temp = ""
-                    for v in value:
-                        temp += str(v)
-                    value = temp
-                item = dict()
-                item['key'] = key
-                item['value'] = value
-                redis_data.append(item)
-            return redis_data
+            cursor, keys = self.__execute(lambda: self.redis.scan(
+                cursor=cursor, match=match, count=count))
+            return int(cursor), self.__fetch_values(keys)
         except:
             self.error_found = True
             self.error = "Failed to Obtain Redis Key value Info."
-            return ["Error", self.error]
+            return 0, list()
+
+    def __fetch_values(self, keys):
+        """
+            Fetch the values for a batch of keys with two round-trips. The
+            first pipeline reads the TYPE of each key, the second reads all
+            the string values with a single MGET and the other types with
+            the command matching their type.
+        """
+        if len(keys) == 0:
+            return list()
+
+        def build_types(pipeline):
+            for key in keys:
+                pipeline.type(key)
+        types = list()
+        for key_type in self.__pipeline(build_types):
+            if isinstance(key_type, bytes):
+                key_type = key_type.decode("utf-8")
+            types.append(key_type)
+
+        strings = [key for key, key_type in zip(keys, types)
+                   if key_type == "string"]
+        others = [(key, key_type) for key, key_type in zip(keys, types)
+                  if key_type not in ("string", "none")]
+
+        def build_values(pipeline):
+            if len(strings) > 0:
+                pipeline.mget(strings)
+            for key, key_type in others:
+                if key_type == "list":
+                    pipeline.lrange(key, 0, -1)
+                elif key_type == "hash":
+                    pipeline.hgetall(key)
+                elif key_type == "set":
+                    pipeline.smembers(key)
+                elif key_type == "zset":
+                    pipeline.zrange(key, 0, -1, withscores=True)
+                else:
+                    pipeline.exists(key)
+        results = self.__pipeline(build_values)
+
+        values = dict()
+        if len(strings) > 0:
+            values.update(zip(strings, results.pop(0)))
+        for (key, key_type), value in zip(others, results):
+            if key_type == "set":
+                value = sorted(value)
+            elif key_type not in ("list", "hash", "zset"):
+                value = "<" + key_type + ">"
+            values[key] = value
+
+        redis_data = list()
+        for key, key_type in zip(keys, types):
+            if key in values:
+                item = dict()
+                item['key'] = key
+                item['value'] = values[key]
+                item['type'] = key_type
+                redis_data.append(item)
+        return redis_data
 
     def reset_error(self):
         """
@@ -167,20 +725,20 @@ class RedisHandler(object):
         self.error_found = False
         self.error = ""
 
-    def get_redis_info(self):
+    def get_redis_info(self, pretty=False):
         """
             This acts as a wrapper to be used for obtaining the Redis
             connection related information.
 
+            @:parameter
+                pretty  -   Indent the JSON for reading. It is compact by
+                            default.
+
             @:return
-                info    -   A Dictionary containing Redis Info.
+                info    -   A JSON string containing Redis Info.
         """
         try:
-            return json.dumps(
-                self.redis.info(),
-                sort_keys=True,
-                indent=8,
-                separators=(',', ': '))
+            return dumps(self.__execute(self.redis.info), pretty=pretty)
         except:
             self.error_found = True
             self.error = "Error Trying to Read Redis Infomration"
@@ -191,3 +749,105 @@ class RedisHandler(object):
             Used for getting the Redis Connection Object.
         """
         return self.redis
+
+
+class RedisCounter(object):
+    """
+        This is the class that keeps a counter in REDIS that stays correct
+        across threads, processes and machines.
+
+        The counter runs in one of the following modes.
+
+            incr    -   Each add is a single INCRBY on the key.
+            batched -   Ranges of batch_size values are reserved with a
+                        single INCRBY and handed out locally. The value in
+                        REDIS runs ahead of the used values by at most one
+                        range per running process. The unused rest of the
+                        range is given back when the process exits.
+            sharded -   Each add is an INCRBY on the shard of this node. The
+                        total is the sum over all the shards.
+    """
+    def __init__(self, handler, key, mode="incr", shard="default",
+                 batch_size=100):
+        """
+            Constructor Function.
+
+            @:parameter
+                handler     -   RedisHandler to use.
+                key         -   Key of the Counter.
+                mode        -   incr, batched or sharded.
+                shard       -   Name of the shard used in sharded mode.
+                batch_size  -   Size of the ranges reserved in batched mode.
+        """
+        self.handler = handler
+        self.key = key
+        self.mode = mode
+        self.shard = shard
+        self.batch_size = batch_size
+        self.next_value = 1
+        self.last_value = 0
+        self.lock = threading.Lock()
+        if mode == "batched":
+            atexit.register(self.close)
+
+    def add(self, amount=1):
+        """
+            Add to the Counter.
+
+            @:return
+                value   -   Last counter value taken by this add, or None if
+                            REDIS couldn't be reached. In sharded mode this
+                            is the value of the local shard.
+        """
+        if self.mode == "sharded":
+            return self.handler.incr_sharded_counter(
+                self.key, self.shard, amount)
+        if self.mode != "batched":
+            return self.handler.incr_counter(self.key, amount)
+
+        with self.lock:
+            left = self.last_value - self.next_value + 1
+            if left < amount:
+                # use up the current range before reserving the next one
+                size = max(self.batch_size, amount - left)
+                last_value = self.handler.incr_counter(self.key, size)
+                if last_value is None:
+                    return None
+                amount -= left
+                self.next_value = last_value - size + 1
+                self.last_value = last_value
+            self.next_value += amount
+            return self.next_value - 1
+
+    def close(self):
+        """
+            Give back the unused rest of the range reserved in batched mode,
+            so that the value in REDIS matches the values taken.
+        """
+        with self.lock:
+            left = self.last_value - self.next_value + 1
+            if self.mode != "batched" or left <= 0:
+                return
+            if self.handler.incr_counter(self.key, -left) is not None:
+                self.next_value = self.last_value + 1
+
+    def get(self):
+        """
+            Read the Counter.
+
+            @:return
+                value   -   Current value, or None if REDIS couldn't be
+                            reached.
+        """
+        if self.mode == "sharded":
+            return self.handler.get_sharded_counter(self.key)
+        value = self.handler.get_from_redis(self.key, auth=True)
+        if value is False:
+            return None
+        if value is None:
+            return 0
+        if self.mode == "batched":
+            # leave out the values this process reserved but hasn't taken
+            with self.lock:
+                return int(value) - (self.last_value - self.next_value + 1)
+        return int(value)
@@ -0,0 +1,310 @@
+#!/usr/bin/python
+"""
+    This file takes care of keeping the results of the tasks run by the
+    nameko TaskService. Completed results are kept for a limited time and
+    the store is capped both on the number of entries and on the memory
+    held by the results, evicting the least recently used ones first.
+
+    Two backends are available. The memory backend keeps the results in
+    the process that ran the task. The redis backend also writes them into
+    Redis so that any TaskService replica can serve them.
+"""
+import binascii
+import json
+import sys
+import time
+from collections import OrderedDict, deque
+
+READY = "ready"
+PENDING = "pending"
+MISSING = "missing"
+EXPIRED = "expired"
+FAILED = "failed"
+
+try:
+    long
+except NameError:
+    long = int
+
+
+class MemoryResultStore(object):
+    """
+        This is the class that keeps the task results in process memory.
+        Each entry holds the Event the result is delivered on.
+    """
+    def __init__(self, ttl=600, max_entries=10000,
+                 max_bytes=256 * 1024 * 1024, max_tombstones=10000):
+        """
+            Constructor Function.
+
+            @:parameter
+                ttl             -   Seconds a completed result is kept.
+                max_entries     -   Maximum number of tasks tracked.
+                max_bytes       -   Maximum memory held by the results.
+                max_tombstones  -   Number of expired/evicted task ids
+                                    remembered to report them as expired
+                                    instead of missing.
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_tombstones = max_tombstones
+        self.records = OrderedDict()
+        self.expiry = deque()
+        self.tombstones = OrderedDict()
+        self.bytes = 0
+        self.pending = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def add(self, task_id, event):
+        """
+            Track a new task whose result will be delivered on event.
+        """
+        self.__sweep()
+        self.records[task_id] = [event, None, 0, False]
+        self.pending += 1
+        self.__evict()
+
+    def complete(self, task_id, result, failed=False):
+        """
+            Record the completion of a task. Starts the TTL of its result.
+        """
+        record = self.records.get(task_id)
+        if record is None or record[1] is not None:
+            return
+        record[1] = time.time()
+        record[2] = sys.getsizeof(result)
+        record[3] = failed
+        self.bytes += record[2]
+        self.pending -= 1
+        self.expiry.append((record[1] + self.ttl, task_id))
+        self.__sweep()
+        self.__evict()
+
+    def get(self, task_id):
+        """
+            Obtain the state of a task.
+
+            @:return
+                status  -   ready, pending, failed, missing or expired.
+                result  -   Result of the task once it is ready.
+        """
+        self.__sweep()
+        record = self.records.get(task_id)
+        if record is None:
+            if task_id in self.tombstones:
+                return EXPIRED, None
+            return MISSING, None
+        self.records.pop(task_id)
+        self.records[task_id] = record
+        if record[1] is None:
+            return PENDING, None
+        if record[3]:
+            return FAILED, None
+        return READY, record[0].wait()
+
+    def get_event(self, task_id):
+        """
+            Obtain the Event the result of a task is delivered on.
+        """
+        record = self.records.get(task_id)
+        if record is None:
+            return None
+        return record[0]
+
+    def __drop(self, task_id):
+        """
+            Forget a completed task and leave a tombstone behind.
+        """
+        record = self.records.pop(task_id)
+        self.bytes -= record[2]
+        self.tombstones[task_id] = True
+        while len(self.tombstones) > self.max_tombstones:
+            self.tombstones.popitem(last=False)
+
+    def __sweep(self):
+        """
+            Drop the completed results whose TTL ran out. Completion times
+            are appended in order, so only the head needs to be checked.
+        """
+        now = time.time()
+        while len(self.expiry) > 0 and self.expiry[0][0] <= now:
+            _, task_id = self.expiry.popleft()
+            record = self.records.get(task_id)
+            if record is not None and record[1] is not None:
+                self.__drop(task_id)
+                self.expired += 1
+
+    def __evict(self):
+        """
+            Evict the least recently used completed results while the store
+            is over its limits. Pending tasks are never evicted.
+        """
+        if len(self.records) <= self.max_entries and \
+                self.bytes <= self.max_bytes:
+            return
+        for task_id in list(self.records.keys()):
+            if len(self.records) <= self.max_entries and \
+                    self.bytes <= self.max_bytes:
+                break
+            if self.records[task_id][1] is not None:
+                self.__drop(task_id)
+                self.evicted += 1
+
+    def get_stats(self):
+        """
+            Obtain the current size and memory use of the store.
+        """
+        return {
+            "backend": "memory",
+            "entries": len(self.records),
+            "pending": self.pending,
+            "bytes": self.bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "expired": self.expired,
+            "evicted": self.evicted
+        }
+
+
+def encode_result(result):
+    """
+        Encode a task result for Redis. Integers are stored as raw
+        big-endian bytes, which takes less than half the space of their
+        decimal form. Anything else is stored as JSON.
+    """
+    if isinstance(result, bool) or not isinstance(result, (int, long)):
+        return b"j" + json.dumps(result).encode("utf-8")
+    sign = b"p"
+    if result < 0:
+        sign = b"n"
+        result = -result
+    digits = "%x" % result
+    if len(digits) % 2:
+        digits = "0" + digits
+    return sign + binascii.unhexlify(digits)
+
+
+def decode_result(value):
+    """
+        Decode a task result written by encode_result.
+    """
+    kind = value[:1]
+    if kind == b"j":
+        return json.loads(value[1:].decode("utf-8"))
+    result = int(binascii.hexlify(value[1:]) or b"0", 16)
+    if kind == b"n":
+        return -result
+    return result
+
+
+class RedisResultStore(object):
+    """
+        This is the class that shares the task results through Redis. Tasks
+        run by this replica are tracked in a local MemoryResultStore as
+        well, so their results are served without a round-trip to Redis.
+
+        Each task uses up to three keys that all expire on their own.
+
+            tasks:pending:<id>  -   Set while the task runs.
+            tasks:result:<id>   -   Encoded result, kept for the TTL.
+            tasks:known:<id>    -   Outlives the result, so that an expired
+                                    task isn't reported as missing.
+    """
+    def __init__(self, redis, ttl=600, max_entries=10000,
+                 max_bytes=256 * 1024 * 1024, pending_ttl=86400,
+                 prefix="tasks"):
+        """
+            Constructor Function.
+
+            @:parameter
+                redis       -   RedisHandler used to share the results.
+                ttl         -   Seconds a completed result is kept.
+                max_entries -   Limits for the local store.
+                max_bytes   -   Limits for the local store.
+                pending_ttl -   Seconds after which a task that never
+                                completed (ex. its replica died) is no
+                                longer reported as pending.
+                prefix      -   Prefix for the Redis keys.
+        """
+        self.redis = redis
+        self.ttl = ttl
+        self.pending_ttl = pending_ttl
+        self.prefix = prefix
+        self.local = MemoryResultStore(ttl=ttl,
+                                       max_entries=max_entries,
+                                       max_bytes=max_bytes)
+
+    def __key(self, kind, task_id):
+        return self.prefix + ":" + kind + ":" + task_id
+
+    def add(self, task_id, event):
+        """
+            Track a new task and publish its pending marker.
+        """
+        self.local.add(task_id, event)
+        self.redis.add_to_redis(
+            self.__key("pending", task_id), "1", expire=self.pending_ttl)
+        self.redis.reset_error()
+
+    def complete(self, task_id, result, failed=False):
+        """
+            Record the completion of a task and publish its result. The
+            keys are all updated in one transaction, so a crash never
+            leaves the task pending.
+        """
+        self.local.complete(task_id, result, failed=failed)
+        if failed:
+            value = b"e"
+        else:
+            value = encode_result(result)
+
+        def build(pipeline):
+            pipeline.set(self.__key("result", task_id), value, ex=self.ttl)
+            pipeline.set(self.__key("known", task_id), "1", ex=self.ttl * 2)
+            pipeline.delete(self.__key("pending", task_id))
+        self.redis.run_pipeline(build)
+        self.redis.reset_error()
+
+    def get(self, task_id):
+        """
+            Obtain the state of a task from the local store, falling back
+            to Redis for the tasks run by the other replicas.
+
+            @:return
+                status  -   ready, pending, failed, missing or expired.
+                result  -   Result of the task once it is ready.
+        """
+        status, result = self.local.get(task_id)
+        if status in (READY, PENDING, FAILED):
+            return status, result
+
+        (value, pending, known) = self.redis.get_many_from_redis([
+            self.__key("result", task_id),
+            self.__key("pending", task_id),
+            self.__key("known", task_id)])
+        self.redis.reset_error()
+        if value is not None:
+            if value[:1] == b"e":
+                return FAILED, None
+            return READY, decode_result(value)
+        if pending is not None:
+            return PENDING, None
+        if known is not None or status == EXPIRED:
+            return EXPIRED, None
+        return MISSING, None
+
+    def get_event(self, task_id):
+        """
+            Obtain the Event for a task run by this replica.
+        """
+        return self.local.get_event(task_id)
+
+    def get_stats(self):
+        """
+            Obtain the current size and memory use of the local store.
+        """
+        stats = self.local.get_stats()
+        stats["backend"] = "redis"
+        return stats
@@ -0,0 +1,182 @@
+#!/usr/bin/python
+"""
+    This file takes care of handing out nameko RPC proxies to the request
+    handlers. A ServiceRpcProxy isn't thread safe and setting one up means
+    a new AMQP connection, channel and reply queue. Instead of building a
+    proxy per request, this keeps a bounded pool of started proxies that
+    are checked out by one request at a time and reused.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from timeit import default_timer
+
+from nameko.exceptions import RemoteError
+from nameko.standalone.rpc import ServiceRpcProxy
+
+from handle_metrics import RPC_CALLS, RPC_ERRORS, RPC_POOL_WAIT
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+class TimedProxy(object):
+    """
+        Wraps an RPC proxy and records the time taken by each call made
+        through it.
+    """
+    def __init__(self, proxy):
+        self.proxy = proxy
+
+    def __getattr__(self, name):
+        method = getattr(self.proxy, name)
+
+        def call(*args, **kwargs):
+            started = default_timer()
+            try:
+                return method(*args, **kwargs)
+            except:
+                RPC_ERRORS.inc((name,))
+                raise
+            finally:
+                RPC_CALLS.observe(default_timer() - started, (name,))
+        return call
+
+
+class RpcProxyPool(object):
+    """
+        This is the class that keeps a bounded pool of RPC proxies for a
+        single nameko service.
+    """
+    def __init__(self, service_name, config, size=4, idle_timeout=60,
+                 timeout=None):
+        """
+            Constructor Function.
+
+            @:parameter
+                service_name    -   nameko Service to Proxy.
+                config          -   nameko config with the AMQP_URI.
+                size            -   Maximum number of proxies. Requests
+                                    wait for a free proxy beyond this.
+                idle_timeout    -   Proxies idle for longer than this many
+                                    seconds are recycled on checkout since
+                                    the broker may have dropped them.
+                timeout         -   Optional RPC reply timeout in seconds.
+        """
+        self.service_name = service_name
+        self.config = config
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.available = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+        self.lock = threading.Lock()
+        self.created = 0
+        self.recycled = 0
+        self.in_use = 0
+
+    def __create(self):
+        """
+            Start a new proxy. Proxies are created lazily on checkout.
+        """
+        if self.timeout is not None:
+            context = ServiceRpcProxy(
+                self.service_name, self.config, timeout=self.timeout)
+        else:
+            context = ServiceRpcProxy(self.service_name, self.config)
+        proxy = context.start()
+        with self.lock:
+            self.created += 1
+        return [context, proxy, time.time()]
+
+    def __discard(self, entry):
+        """
+            Stop a proxy that is no longer trusted.
+        """
+        with self.lock:
+            self.recycled += 1
+        try:
+            entry[0].stop()
+        except:
+            pass
+
+    def __checkout(self):
+        """
+            Obtain a live proxy. Proxies that were idle for too long are
+            replaced by new ones.
+        """
+        while True:
+            try:
+                entry = self.available.get_nowait()
+            except queue.Empty:
+                return self.__create()
+            if time.time() - entry[2] < self.idle_timeout:
+                return entry
+            self.__discard(entry)
+
+    @contextmanager
+    def acquire(self):
+        """
+            Context Manager that hands out a proxy for the duration of a
+            request. The proxy goes back into the pool once done, unless
+            the call failed for any reason other than an error raised by
+            the remote service itself.
+        """
+        started = default_timer()
+        self.slots.acquire()
+        RPC_POOL_WAIT.observe(default_timer() - started)
+        entry = None
+        healthy = True
+        try:
+            entry = self.__checkout()
+            with self.lock:
+                self.in_use += 1
+            yield TimedProxy(entry[1])
+        except RemoteError:
+            raise
+        except:
+            healthy = False
+            raise
+        finally:
+            if entry is not None:
+                with self.lock:
+                    self.in_use -= 1
+                if healthy:
+                    entry[2] = time.time()
+                    self.available.put(entry)
+                else:
+                    self.__discard(entry)
+            self.slots.release()
+
+    def get_stats(self):
+        """
+            Obtain the pool utilization figures.
+
+            @:return
+                stats   -   Dictionary with size, in_use, idle, created and
+                            recycled counts.
+        """
+        with self.lock:
+            return {
+                "size": self.size,
+                "in_use": self.in_use,
+                "idle": self.available.qsize(),
+                "created": self.created,
+                "recycled": self.recycled
+            }
+
+    def close(self):
+        """
+            Stop all the idle proxies.
+        """
+        while True:
+            try:
+                entry = self.available.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                entry[0].stop()
+            except:
+                pass
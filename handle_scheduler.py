@@ -0,0 +1,152 @@
+#!/usr/bin/python
+"""
+    This file takes care of admitting and scheduling the tasks run by the
+    nameko TaskService. At most max_concurrency tasks run at a time, the
+    rest wait in a bounded queue ordered by their estimated cost and
+    anything beyond the queue limit is rejected right away.
+"""
+import heapq
+import itertools
+import time
+from collections import deque
+
+
+class TaskScheduler(object):
+    """
+        This is the class that sits in front of the task threads and
+        decides when each submitted task gets to run.
+    """
+    def __init__(self, spawn, max_concurrency=4, max_queue=100,
+                 starvation_limit=30):
+        """
+            Constructor Function.
+
+            @:parameter
+                spawn               -   Callable that starts a function in
+                                        a new thread and returns an object
+                                        with a link(callback) method.
+                max_concurrency     -   Maximum tasks running at a time.
+                max_queue           -   Maximum tasks waiting to run.
+                starvation_limit    -   Seconds after which the oldest
+                                        queued task runs next regardless of
+                                        its cost.
+        """
+        self.spawn = spawn
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.starvation_limit = starvation_limit
+        self.heap = list()
+        self.order = deque()
+        self.sequence = itertools.count()
+        self.queued = 0
+        self.running = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.started = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def submit(self, cost, run, on_done):
+        """
+            Submit a task to be run.
+
+            @:parameter
+                cost    -   Estimated cost. Cheaper tasks run first.
+                run     -   Callable doing the actual work.
+                on_done -   Callable invoked with the finished thread.
+
+            @:return
+                admitted    -   False if the queue is full and the task
+                                was rejected.
+        """
+        job = [cost, next(self.sequence), time.time(), run, on_done, False]
+        if self.running < self.max_concurrency and self.queued == 0:
+            self.submitted += 1
+            self.__start(job)
+            return True
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            return False
+        self.submitted += 1
+        heapq.heappush(self.heap, job)
+        self.order.append(job)
+        self.queued += 1
+        self.__dispatch()
+        return True
+
+    def __start(self, job):
+        """
+            Run a job in a new thread and account for its wait time.
+        """
+        job[5] = True
+        wait = time.time() - job[2]
+        self.started += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.running += 1
+        thread = self.spawn(job[3])
+        thread.link(lambda finished: self.__finished(finished, job[4]))
+
+    def __finished(self, thread, on_done):
+        """
+            Release the slot of a finished job and start the next one.
+        """
+        self.running -= 1
+        self.completed += 1
+        try:
+            on_done(thread)
+        finally:
+            self.__dispatch()
+
+    def __next(self):
+        """
+            Pick the next job. This is the cheapest one unless the oldest
+            job has waited for longer than the starvation limit.
+        """
+        while len(self.order) > 0 and self.order[0][5]:
+            self.order.popleft()
+        if len(self.order) > 0 and \
+                time.time() - self.order[0][2] >= self.starvation_limit:
+            return self.order.popleft()
+        while len(self.heap) > 0:
+            job = heapq.heappop(self.heap)
+            if not job[5]:
+                return job
+        return None
+
+    def __dispatch(self):
+        """
+            Start queued jobs while there are free slots.
+        """
+        while self.running < self.max_concurrency and self.queued > 0:
+            job = self.__next()
+            if job is None:
+                break
+            self.queued -= 1
+            self.__start(job)
+
+    def get_stats(self):
+        """
+            Obtain the queue depth and wait time figures.
+        """
+        average_wait = 0.0
+        if self.started > 0:
+            average_wait = self.total_wait / self.started
+        oldest_wait = 0.0
+        for job in self.order:
+            if not job[5]:
+                oldest_wait = time.time() - job[2]
+                break
+        return {
+            "running": self.running,
+            "queued": self.queued,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "average_wait": average_wait,
+            "max_wait": self.max_wait,
+            "oldest_wait": oldest_wait
+        }
@@ -0,0 +1,450 @@
+#!/usr/bin/python
+"""
+    This file takes care of persisting records into PostgreSQL in a
+    write-behind mode. Records are queued either in the process memory or
+    in a Redis List and a background thread flushes them into Postgres in
+    bulk with a single multi-row INSERT once enough of them are queued up
+    or once the flush interval has passed.
+
+    A batch that fails while PostgreSQL is reachable is written again in
+    halves down to single records, so one bad record doesn't hold up the
+    others. Records that keep failing are moved to a dead-letter list.
+
+    In the redis mode a batch is moved into a processing list of its own
+    instance and only removed from there once committed. The batches left
+    in the processing list of an instance that died are queued again, so a
+    crash can write a batch twice but never loses one.
+
+    A queued value that can't be decoded is dead-lettered right away, and a
+    flush that fails for any other reason is logged and tried again after
+    the flush interval, so the flusher never stops.
+"""
+import atexit
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+
+QUEUED = "queued"
+COMMITTED = "committed"
+FAILED = "failed"
+
+LOGGER = logging.getLogger(__name__)
+
+
+class WriteBehind(object):
+    """
+        This is the class that queues up records for a single bulk INSERT
+        query and takes care of flushing them into PostgreSQL.
+    """
+    def __init__(self, postgres, query_string, mode="memory", redis=None,
+                 redis_key="demo:write-behind", batch_size=500,
+                 flush_interval=1.0, max_queue=10000,
+                 synchronous_commit=True, on_flush=None, max_attempts=3,
+                 max_dead_letters=1000, recover_interval=60.0):
+        """
+            Constructor Function.
+
+            @:parameter
+                postgres            -   PostgreSQL Handler to flush into.
+                query_string        -   Multi-row INSERT with a single %s
+                                        placeholder for the VALUES list.
+                mode                -   memory or redis.
+                redis               -   RedisHandler used in redis mode.
+                redis_key           -   Redis List holding queued records.
+                batch_size          -   Records written per INSERT.
+                flush_interval      -   Max seconds a record stays queued.
+                max_queue           -   Queue limit before records are
+                                        committed synchronously.
+                synchronous_commit  -   Wait for the WAL flush on commit.
+                on_flush            -   Callable invoked after each batch
+                                        is committed.
+                max_attempts        -   Flushes a record may fail in before
+                                        it is dead-lettered.
+                max_dead_letters    -   Dead-lettered records kept.
+                recover_interval    -   Seconds between two looks for the
+                                        processing lists of dead instances
+                                        in the redis mode.
+        """
+        self.postgres = postgres
+        self.query_string = query_string
+        self.mode = mode
+        self.redis = redis
+        self.redis_key = redis_key
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.synchronous_commit = synchronous_commit
+        self.on_flush = on_flush
+        self.max_attempts = max_attempts
+        self.max_dead_letters = max_dead_letters
+        self.recover_interval = recover_interval
+        self.queue = deque()
+        self.pending = 0
+        # failed flushes of the records that are queued again, and the
+        # records given up on in the memory mode
+        self.failures = dict()
+        self.dead_letters = deque(maxlen=max_dead_letters)
+        self.dead_lettered = 0
+        instance = uuid.uuid4().hex
+        self.processing_key = "%s:processing:%s" % (redis_key, instance)
+        self.alive_key = "%s:alive:%s" % (redis_key, instance)
+        self.dead_letter_key = redis_key + ":dead"
+        self.recovered_at = 0
+        self.condition = threading.Condition()
+        self.flush_lock = threading.Lock()
+        self.running = True
+        self.thread = threading.Thread(target=self.__run)
+        self.thread.daemon = True
+        self.thread.start()
+        atexit.register(self.close)
+
+    def submit(self, binding):
+        """
+            Queue a record for the next flush.
+
+            @:parameter
+                binding     -   Tuple of values for a single row.
+
+            @:return
+                status      -   queued, committed or failed. Records are
+                                committed synchronously when the queue is
+                                full or Redis can't be reached.
+        """
+        if self.running:
+            if self.mode == "redis":
+                self.redis.add_to_redis_list(
+                    self.redis_key, json.dumps(list(binding)))
+                if not self.redis.check_error():
+                    self.__queued(1)
+                    return QUEUED
+                self.redis.reset_error()
+            else:
+                with self.condition:
+                    if len(self.queue) < self.max_queue:
+                        self.queue.append(tuple(binding))
+                        self.pending = len(self.queue)
+                        if self.pending >= self.batch_size:
+                            self.condition.notify()
+                        return QUEUED
+        return self.__write([tuple(binding)])
+
+    def submit_many(self, bindings):
+        """
+            Queue a list of records for the next flush.
+
+            @:parameter
+                bindings    -   List of Tuples, one per row.
+
+            @:return
+                statuses    -   queued, committed or failed for each record.
+                                Records that don't fit in the queue are
+                                committed synchronously in one batch.
+        """
+        bindings = [tuple(binding) for binding in bindings]
+        queued = 0
+        if self.running:
+            if self.mode == "redis":
+                self.redis.add_many_to_redis_list(
+                    self.redis_key,
+                    [json.dumps(list(binding)) for binding in bindings])
+                if not self.redis.check_error():
+                    queued = len(bindings)
+                    self.__queued(queued)
+                else:
+                    self.redis.reset_error()
+            else:
+                with self.condition:
+                    queued = max(0, min(len(bindings),
+                                        self.max_queue - len(self.queue)))
+                    self.queue.extend(bindings[:queued])
+                    self.pending = len(self.queue)
+                    if self.pending >= self.batch_size:
+                        self.condition.notify()
+        statuses = [QUEUED] * queued
+        if queued < len(bindings):
+            status = self.__write(bindings[queued:])
+            statuses.extend([status] * (len(bindings) - queued))
+        return statuses
+
+    def __queued(self, count):
+        """
+            Account for records queued in Redis and wake up the flusher once
+            a full batch is available.
+        """
+        with self.condition:
+            self.pending += count
+            if self.pending >= self.batch_size:
+                self.condition.notify()
+
+    def __write(self, bindings):
+        """
+            Write a batch of records using one multi-row INSERT.
+        """
+        error = self.postgres.run_query_store_many(
+            self.query_string,
+            bindings,
+            synchronous_commit=self.synchronous_commit)
+        if error is None or len(error) > 0:
+            return FAILED
+        if self.on_flush is not None:
+            try:
+                self.on_flush(bindings)
+            except Exception:
+                # the batch is committed either way
+                LOGGER.exception("Write-behind on_flush callback failed")
+        return COMMITTED
+
+    def __take(self):
+        """
+            Remove the next batch of records from the queue. In the redis
+            mode the batch is moved into the processing list, along with
+            whatever a failed call left there.
+        """
+        if self.mode == "redis":
+            values = self.redis.move_redis_list(
+                self.redis_key, self.processing_key, self.batch_size)
+            batch = list()
+            raw = list()
+            for value in values:
+                binding = self.__decode(value)
+                if binding is None:
+                    self.__dead_letter(value, 0,
+                                       "Failed to Decode the Record.")
+                else:
+                    batch.append(binding)
+                    raw.append(value)
+            if len(batch) == 0 and len(values) > 0:
+                self.redis.delete_from_redis(self.processing_key)
+            return batch, raw
+        with self.condition:
+            batch = list()
+            while len(self.queue) > 0 and len(batch) < self.batch_size:
+                batch.append(self.queue.popleft())
+            self.pending = len(self.queue)
+            return batch, batch
+
+    @staticmethod
+    def __decode(value):
+        """
+            Decode a record queued in Redis.
+
+            @:return
+                binding     -   Tuple of values or None if the record isn't
+                                a JSON list.
+        """
+        try:
+            binding = json.loads(value)
+        except (TypeError, ValueError):
+            return None
+        if not isinstance(binding, list):
+            return None
+        return tuple(binding)
+
+    def __give_back(self, raw):
+        """
+            Return the records of a batch that are to be retried to the head
+            of the queue. The rest of the batch is done with.
+        """
+        if self.mode == "redis":
+            self.redis.restore_redis_list(
+                self.processing_key, self.redis_key, raw)
+            return
+        with self.condition:
+            self.queue.extendleft(reversed(raw))
+            self.pending = len(self.queue)
+
+    def __reachable(self):
+        """
+            Check if PostgreSQL answers. A batch that failed while it
+            doesn't hit a transient error and is retried as a whole.
+        """
+        try:
+            self.postgres.ping()
+            return True
+        except Exception:
+            return False
+
+    def __split(self, batch, raw):
+        """
+            Write a failed batch again in halves down to single records, so
+            the good records get committed and the bad ones singled out.
+
+            @:return
+                committed   -   Number of records committed.
+                retry       -   Raw records to queue again.
+        """
+        if len(batch) == 1:
+            return 0, self.__failed(raw[0])
+        committed = 0
+        retry = list()
+        half = len(batch) // 2
+        for (part, part_raw) in ((batch[:half], raw[:half]),
+                                 (batch[half:], raw[half:])):
+            if self.__write(part) == COMMITTED:
+                committed += len(part)
+                self.__forget(part_raw)
+            else:
+                (count, left) = self.__split(part, part_raw)
+                committed += count
+                retry.extend(left)
+        return committed, retry
+
+    def __failed(self, value):
+        """
+            Count a failed flush of a record and dead-letter it once it has
+            failed max_attempts times.
+
+            @:return
+                retry       -   The record if it is to be queued again.
+        """
+        errors = self.failures.pop(value, 0) + 1
+        if errors < self.max_attempts:
+            self.failures[value] = errors
+            return [value]
+        error = (self.postgres.error or "").strip().splitlines()[-1:]
+        binding = self.__decode(value) if self.mode == "redis" \
+            else list(value)
+        self.__dead_letter(list(binding), errors, error[0] if error else None)
+        return []
+
+    def __dead_letter(self, binding, errors, error):
+        """
+            Keep a record given up on in the dead-letter list.
+
+            @:parameter
+                binding     -   Values of the record, or the raw value if it
+                                couldn't be decoded.
+                errors      -   Failed flushes of the record.
+                error       -   Last error.
+        """
+        if isinstance(binding, bytes):
+            binding = binding.decode("utf-8", "replace")
+        letter = {
+            "binding": binding,
+            "errors": errors,
+            "error": error
+        }
+        self.dead_lettered += 1
+        if self.mode == "redis":
+            self.redis.add_to_capped_redis_list(
+                self.dead_letter_key, json.dumps(letter),
+                self.max_dead_letters)
+        else:
+            self.dead_letters.append(letter)
+
+    def __forget(self, raw):
+        if len(self.failures) > 0:
+            for value in raw:
+                self.failures.pop(value, None)
+
+    def __recover(self):
+        """
+            Queue again the batches left in the processing lists of the
+            instances that stopped refreshing their alive key.
+        """
+        now = time.time()
+        self.redis.add_to_redis(self.alive_key, 1,
+                                expire=int(max(60, 10 * self.flush_interval)))
+        if now - self.recovered_at < self.recover_interval:
+            return
+        self.recovered_at = now
+        for key in self.redis.scan_keys(
+                match=self.redis_key + ":processing:*"):
+            if isinstance(key, bytes):
+                key = key.decode("utf-8")
+            if key == self.processing_key:
+                continue
+            alive = self.redis_key + ":alive:" + key.rsplit(":", 1)[1]
+            if self.redis.get_from_redis(alive) is None:
+                self.redis.restore_redis_list(key, self.redis_key)
+
+    def flush(self):
+        """
+            Flush all the queued records into PostgreSQL. A batch that fails
+            while PostgreSQL can't be reached is kept queued as a whole for
+            the next flush. Otherwise its good records are committed and the
+            ones that failed are queued again or dead-lettered.
+
+            @:return
+                flushed     -   Number of records committed.
+        """
+        flushed = 0
+        with self.flush_lock:
+            if self.mode == "redis":
+                self.__recover()
+            while True:
+                batch, raw = self.__take()
+                if len(batch) == 0:
+                    break
+                try:
+                    written = self.__write(batch)
+                except Exception:
+                    self.__give_back(raw)
+                    raise
+                if written == COMMITTED:
+                    flushed += len(batch)
+                    self.__forget(raw)
+                    if self.mode == "redis":
+                        self.redis.delete_from_redis(self.processing_key)
+                    continue
+                if not self.__reachable():
+                    self.__give_back(raw)
+                    break
+                (committed, retry) = self.__split(batch, raw)
+                flushed += committed
+                self.__give_back(retry)
+                if len(retry) > 0:
+                    break
+            if self.mode == "redis":
+                with self.condition:
+                    self.pending = 0
+        return flushed
+
+    def get_dead_letters(self):
+        """
+            Obtain the records given up on, oldest first.
+
+            @:return
+                letters     -   List of dictionaries with the binding, the
+                                failed flushes and the last error.
+        """
+        if self.mode == "redis":
+            return [json.loads(value) for value in
+                    self.redis.get_redis_list(self.dead_letter_key)]
+        return list(self.dead_letters)
+
+    def __run(self):
+        """
+            Background flusher loop.
+        """
+        while self.running:
+            with self.condition:
+                if self.running and self.pending < self.batch_size:
+                    self.condition.wait(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                # the records stay queued for the next flush
+                LOGGER.exception("Write-behind flush failed")
+                with self.condition:
+                    if self.running:
+                        self.condition.wait(self.flush_interval)
+
+    def close(self, timeout=None):
+        """
+            Stop the background flusher and drain whatever is queued. New
+            records submitted after this point are committed synchronously.
+        """
+        if not self.running:
+            return
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join(timeout)
+        self.flush()
+        if self.mode == "redis":
+            # whatever is left in processing is recovered by the others
+            self.redis.delete_from_redis(self.alive_key)
@@ -0,0 +1,63 @@
+#!/usr/bin/python
+"""
+    This file starts the Flask Application in an asynchronous serving mode.
+
+    Each request runs on a green thread of eventlet instead of an OS thread.
+    The blocking socket calls made by the Redis client, psycopg2 and the
+    nameko RPC proxies are turned into cooperative ones, so a single process
+    can hold thousands of requests that are waiting on I/O. The routes and
+    the handler classes are the same ones used by app.py.
+
+    Usage:
+        python serve_async.py
+"""
+
+# Patch the standard library before anything else gets imported, so that
+# the sockets, locks and threads used by the handlers are green ones.
+import eventlet
+eventlet.monkey_patch()
+
+import psycopg2
+from psycopg2 import extensions
+from eventlet import wsgi
+from eventlet.hubs import trampoline
+
+import app as application
+from config import get_rest_information, get_async_config
+
+
+def eventlet_wait_callback(connection, timeout=-1):
+    """
+        Wait callback that lets psycopg2 yield to the eventlet hub while it
+        waits on Postgres instead of blocking the whole process.
+    """
+    while True:
+        state = connection.poll()
+        if state == extensions.POLL_OK:
+            break
+        elif state == extensions.POLL_READ:
+            trampoline(connection.fileno(), read=True)
+        elif state == extensions.POLL_WRITE:
+            trampoline(connection.fileno(), write=True)
+        else:
+            raise psycopg2.OperationalError(
+                "Bad result from poll: %r" % state)
+
+
+def main():
+    """
+        Set-up the handlers and serve the application on a pool of green
+        threads.
+    """
+    (hostname, port, debug) = get_rest_information()
+    (concurrency, backlog) = get_async_config()
+    extensions.set_wait_callback(eventlet_wait_callback)
+    application.initialize()
+    application.app.debug = debug
+    wsgi.server(eventlet.listen((hostname, port), backlog=backlog),
+                application.app,
+                custom_pool=eventlet.GreenPool(concurrency))
+
+
+if __name__ == "__main__":
+    main()
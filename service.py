@@ -1,19 +1,154 @@
+import hashlib
+import json
+import multiprocessing
+import time
 import uuid
+from collections import OrderedDict
 
 import eventlet
+from eventlet import tpool
 from eventlet.event import Event
 from nameko.rpc import rpc
 from nameko.extensions import DependencyProvider
 
+from config import get_fibonacci_config, get_task_result_config, \
+    get_redis_config, get_redis_pool_config, get_task_dedupe_config, \
+    get_task_scheduler_config, get_task_wait_config, \
+    get_result_output_config
+from handle_digits import render, VALUE, DECIMAL
+from handle_redis import RedisHandler
+from handle_scheduler import TaskScheduler
+from handle_results import MemoryResultStore, RedisResultStore, READY, \
+    PENDING
+
+(MEMO_ENTRIES, MEMO_BYTES, STEP_LIMIT, OFFLOAD_THRESHOLD,
+ PROCESSES) = get_fibonacci_config()
+(_, EDGE_DIGITS, MAX_EDGE_DIGITS, _,
+ RENDER_OFFLOAD_DIGITS) = get_result_output_config()
+OFFLOAD_POLL_INTERVAL = 0.01
+REJECTED = "rejected"
+
+
+class FibonacciMemo(object):
+    """
+        LRU of recently computed (F(k), F(k+1)) pairs, bounded both by the
+        number of entries and by the bytes held by the integers.
+    """
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.pairs = OrderedDict()
+        self.bytes = 0
+
+    def get(self, n):
+        pair = self.pairs.pop(n, None)
+        if pair is not None:
+            self.pairs[n] = pair
+        return pair
+
+    def nearest_below(self, n, step_limit):
+        # closest checkpoint k <= n that is at most step_limit away
+        best = None
+        for k in self.pairs:
+            if k <= n and n - k <= step_limit and (best is None or k > best):
+                best = k
+        if best is None:
+            return None, None
+        return best, self.get(best)
+
+    def put(self, n, pair):
+        size = (pair[0].bit_length() + pair[1].bit_length()) // 8
+        if self.max_entries <= 0 or size > self.max_bytes:
+            return
+        old = self.pairs.pop(n, None)
+        if old is not None:
+            self.bytes -= (old[0].bit_length() + old[1].bit_length()) // 8
+        self.pairs[n] = pair
+        self.bytes += size
+        while len(self.pairs) > self.max_entries or self.bytes > self.max_bytes:
+            _, evicted = self.pairs.popitem(last=False)
+            self.bytes -= (evicted[0].bit_length() +
+                           evicted[1].bit_length()) // 8
+
+
+MEMO = FibonacciMemo(MEMO_ENTRIES, MEMO_BYTES)
+PROCESS_POOL = None
+
+
+def fibonacci_pair(n, cooperative=True):
+    # fast doubling: O(log n) big-integer multiplications for (F(n), F(n+1))
+    #   F(2k)   = F(k) * (2 * F(k+1) - F(k))
+    #   F(2k+1) = F(k) ** 2 + F(k+1) ** 2
+    a, b = 0, 1
+    for bit in bin(n)[2:]:
+        c = a * ((b << 1) - a)
+        d = a * a + b * b
+        if bit == '1':
+            a, b = d, c + d
+        else:
+            a, b = c, d
+        if cooperative:
+            eventlet.sleep()  # yield between the multiplications
+    return a, b
+
+
+def offload(function, *args):
+    # run `function` in a worker process and poll for it, so that the
+    # eventlet hub keeps serving the other tasks in the meantime. The workers
+    # are started with spawn: a child forked from this process, after
+    # eventlet patched threading, can inherit locks held by green threads
+    # that don't exist in it and deadlock. Python 2 has no spawn, so there
+    # the call runs in the native thread pool of eventlet instead
+    global PROCESS_POOL
+    if not hasattr(multiprocessing, "get_context"):
+        return tpool.execute(function, *args)
+    if PROCESS_POOL is None:
+        PROCESS_POOL = multiprocessing.get_context("spawn").Pool(PROCESSES)
+    result = PROCESS_POOL.apply_async(function, args)
+    while not result.ready():
+        eventlet.sleep(OFFLOAD_POLL_INTERVAL)
+    return result.get()
+
+
+def offload_fibonacci_pair(n):
+    return offload(fibonacci_pair, n, False)
+
+
+def render_result(result, mode=VALUE, size=None):
+    # write out a result in one of the output modes of handle_digits. The
+    # decimal form of a huge result stalls the hub for long enough to be
+    # worth a trip to the process pool
+    if size is None:
+        size = EDGE_DIGITS
+    size = min(max(int(size), 1), MAX_EDGE_DIGITS)
+    if mode == DECIMAL and RENDER_OFFLOAD_DIGITS > 0 and \
+            hasattr(result, "bit_length") and \
+            result.bit_length() * 0.30103 >= RENDER_OFFLOAD_DIGITS:
+        return offload(render, result, mode, size)
+    return render(result, mode, size)
+
 
 # a simple task
 def fibonacci(n):
-    a, b = 1, 1
-    for i in xrange(n-1):
-        a, b = b, a+b
-        if n % 50 == 0:
-            eventlet.sleep()  # won't yield voluntarily since there's no i/o
-    return a
+    if n <= 1:
+        return 1
+
+    pair = MEMO.get(n)
+    if pair is None:
+        k, pair = MEMO.nearest_below(n, STEP_LIMIT)
+        if pair is not None:
+            # derive n incrementally from a nearby checkpoint
+            a, b = pair
+            for i in range(n - k):
+                a, b = b, a + b
+            pair = (a, b)
+        elif OFFLOAD_THRESHOLD > 0 and n >= OFFLOAD_THRESHOLD:
+            pair = offload_fibonacci_pair(n)
+        else:
+            pair = fibonacci_pair(n)
+        MEMO.put(n, pair)
+    return pair[0]
 
 
 class TaskProcessor(DependencyProvider):
@@ -23,39 +158,209 @@ class TaskProcessor(DependencyProvider):
             'fibonacci': fibonacci
             # add other tasks here
         }
-        self.results = {}
+        # estimated cost of each task, used to run the cheap ones first
+        self.costs = {
+            'fibonacci': lambda n: n
+        }
+        self.results = None
+        self.scheduler = None
+        # in-flight and recently completed computations, keyed by the task
+        # name and arguments: key -> [event, completed_at, task_ids]. A
+        # completed flight drops its event and keeps a single task id, so
+        # its result is only held by the result store and its limits
+        self.flights = OrderedDict()
+        (self.dedupe_ttl, self.max_flights,
+         self.content_ids) = get_task_dedupe_config()
+        # callers blocked in wait_result, each one holds a worker
+        self.waiters = 0
+        (self.max_wait, self.max_waiters, self.poll_interval,
+         _, _) = get_task_wait_config()
+
+    def setup(self):
+        # pick the result backend once the container starts, so that
+        # replicas sharing the redis backend can all serve get_result
+        (backend, ttl, max_entries, max_bytes,
+         pending_ttl) = get_task_result_config()
+        if backend == "redis":
+            (hostname, port, password) = get_redis_config()
+            (max_connections, socket_timeout, connect_timeout, retries,
+             backoff, failure_threshold,
+             reset_timeout) = get_redis_pool_config()
+            self.results = RedisResultStore(
+                RedisHandler(host=hostname,
+                             port=port,
+                             password=password,
+                             max_connections=max_connections,
+                             socket_timeout=socket_timeout,
+                             connect_timeout=connect_timeout,
+                             retries=retries,
+                             backoff=backoff,
+                             failure_threshold=failure_threshold,
+                             reset_timeout=reset_timeout),
+                ttl=ttl,
+                max_entries=max_entries,
+                max_bytes=max_bytes,
+                pending_ttl=pending_ttl)
+        else:
+            self.results = MemoryResultStore(ttl=ttl,
+                                             max_entries=max_entries,
+                                             max_bytes=max_bytes)
+
+        (max_concurrency, max_queue,
+         starvation_limit) = get_task_scheduler_config()
+        self.scheduler = TaskScheduler(self.container.spawn_managed_thread,
+                                       max_concurrency=max_concurrency,
+                                       max_queue=max_queue,
+                                       starvation_limit=starvation_limit)
 
     def start_task(self, name, args, kwargs):
-        # generate unique id
-        task_id = uuid.uuid4().hex
+        key = self._flight_key(name, args, kwargs)
+
+        # generate unique id, or one derived from the task and arguments
+        if self.content_ids and key is not None:
+            task_id = hashlib.sha1(key.encode("utf-8")).hexdigest()
+            if self.results.get(task_id)[0] in (READY, PENDING):
+                return task_id
+        else:
+            task_id = uuid.uuid4().hex
+
+        # share an identical computation that is running or just finished
+        flight = self._get_flight(key)
+        if flight is not None:
+            if flight[1] is None:
+                self.results.add(task_id, flight[0])
+                flight[2].append(task_id)
+                return task_id
+            status, result = self.results.get(flight[2][0])
+            if status == READY:
+                event = Event()
+                event.send(result)
+                self.results.add(task_id, event)
+                self.results.complete(task_id, result)
+                return task_id
+            # the result store let go of it, compute it again
+            self.flights.pop(key, None)
 
         # get the named task
         task = self.tasks.get(name)
 
-        # execute it in a container thread and send the result to an Event
+        # queue it to run in a container thread and send the result to an
+        # Event; submissions beyond the queue limit are turned away
         event = Event()
-        gt = self.container.spawn_managed_thread(lambda: task(*args, **kwargs))
-        gt.link(lambda res: event.send(res.wait()))
+        flight = [event, None, [task_id]]
+        admitted = self.scheduler.submit(
+            self._estimate_cost(name, args, kwargs),
+            lambda: task(*args, **kwargs),
+            lambda res: self._complete(key, flight, res))
+        if not admitted:
+            return REJECTED
+        if key is not None:
+            self.flights[key] = flight
 
         # store the Event and return the task's unique id to the caller
-        self.results[task_id] = event
+        self.results.add(task_id, event)
         return task_id
 
-    def get_result(self, task_id):
-        # get the result Event for `task_id`
-        result = self.results.get(task_id)
-        if result is None:
-            return "missing"
-        # if the Event is ready, return its value
-        if result.ready():
-            return result.wait()
-        return "pending"
+    def _estimate_cost(self, name, args, kwargs):
+        cost = self.costs.get(name)
+        try:
+            return cost(*args, **kwargs)
+        except (TypeError, ValueError):
+            return 0
+
+    def _flight_key(self, name, args, kwargs):
+        # arguments that can't be serialized are never coalesced
+        try:
+            return json.dumps([name, list(args), kwargs], sort_keys=True)
+        except (TypeError, ValueError):
+            return None
+
+    def _get_flight(self, key):
+        # drop completed flights past their ttl and the oldest ones beyond
+        # max_flights; running flights are always kept
+        now = time.time()
+        for flight_key in list(self.flights.keys()):
+            flight = self.flights[flight_key]
+            if flight[1] is not None and \
+                    (now - flight[1] >= self.dedupe_ttl or
+                     len(self.flights) > self.max_flights):
+                del self.flights[flight_key]
+        if key is None:
+            return None
+        return self.flights.get(key)
+
+    def _complete(self, key, flight, gt):
+        event = flight[0]
+        try:
+            result = gt.wait()
+        except Exception as exc:
+            # failures aren't shared with later submissions
+            self.flights.pop(key, None)
+            event.send_exception(exc)
+            for task_id in flight[2]:
+                self.results.complete(task_id, None, failed=True)
+            return
+        flight[1] = time.time()
+        event.send(result)
+        for task_id in flight[2]:
+            self.results.complete(task_id, result)
+        flight[0] = None
+        flight[2] = flight[2][:1]
+
+    def get_result(self, task_id, mode=VALUE, size=None):
+        # look up `task_id` locally or in the shared backend; anything that
+        # isn't ready is reported by its status. `mode` picks the output,
+        # see handle_digits
+        status, result = self.results.get(task_id)
+        if status == READY:
+            return render_result(result, mode, size)
+        return status
+
+    def wait_result(self, task_id, timeout, mode=VALUE, size=None):
+        # block until the result of `task_id` is ready or `timeout` passes.
+        # tasks run here are waited on through their Event, the ones run by
+        # another replica by polling the shared backend. Past max_waiters
+        # this answers right away like get_result
+        timeout = max(0, min(float(timeout), self.max_wait))
+        status, result = self.results.get(task_id)
+        if status != PENDING or timeout == 0 or \
+                self.waiters >= self.max_waiters:
+            if status == READY:
+                return render_result(result, mode, size)
+            return status
+
+        self.waiters += 1
+        try:
+            event = self.results.get_event(task_id)
+            with eventlet.Timeout(timeout, False):
+                if event is not None:
+                    try:
+                        event.wait()
+                    except Exception:
+                        # the failure is reported by get_result
+                        pass
+                else:
+                    while self.results.get(task_id)[0] == PENDING:
+                        eventlet.sleep(self.poll_interval)
+        finally:
+            self.waiters -= 1
+        return self.get_result(task_id, mode, size)
+
+    def get_stats(self):
+        return {
+            'results': self.results.get_stats(),
+            'scheduler': self.scheduler.get_stats(),
+            'flights': len(self.flights),
+            'waiters': self.waiters
+        }
 
     def get_dependency(self, worker_ctx):
 
         class TaskApi(object):
             start_task = self.start_task
             get_result = self.get_result
+            wait_result = self.wait_result
+            get_stats = self.get_stats
 
         return TaskApi()
 
@@ -70,5 +375,13 @@ class TaskService(object):
         return self.processor.start_task(name, args, kwargs)
 
     @rpc
-    def get_result(self, task_id):
-        return self.processor.get_result(task_id)
+    def get_result(self, task_id, mode="value", size=None):
+        return self.processor.get_result(task_id, mode, size)
+
+    @rpc
+    def wait_result(self, task_id, timeout=25, mode="value", size=None):
+        return self.processor.wait_result(task_id, timeout, mode, size)
+
+    @rpc
+    def get_stats(self):
+        return self.processor.get_stats()